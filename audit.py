@@ -0,0 +1,223 @@
+"""Audit trail for logins and user administration, written off the request path.
+
+Handlers only enqueue an event (a dict, no I/O); one background writer per
+worker drains the queue and stores events with multi-row INSERTs, at most
+AUDIT_BATCH_SIZE per statement and at least every AUDIT_FLUSH_INTERVAL seconds.
+When the queue is full, AUDIT_BACKPRESSURE decides what gives:
+
+    block        the handler waits for room (the default: no loss, but requests
+                 slow down while the database is unreachable)
+    drop_newest  the new event is discarded (counted in audit_dropped_total)
+    drop_oldest  the oldest queued event is discarded to make room
+
+A batch the database cannot take (connection lost, lock timeout) stays queued
+and is retried with a backoff doubling up to AUDIT_RETRY_MAX_BACKOFF seconds,
+so an outage delays the trail but loses nothing. Only a batch rejected for
+its data (DataError, IntegrityError) is split up: its events are written one
+by one and those still rejected are dropped (and counted), so one bad row
+cannot stall the trail. Whatever is queued at shutdown is written before the
+worker exits.
+"""
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+from typing import List, Optional
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy.exc import DataError, IntegrityError
+from database import async_session_scope
+from models import AuditEvent
+import crud
+
+load_dotenv()
+
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "true").lower() in ("1", "true", "yes")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+AUDIT_BACKPRESSURE = os.getenv("AUDIT_BACKPRESSURE", "block")  # block | drop_newest | drop_oldest
+AUDIT_RETRY_MAX_BACKOFF = float(os.getenv("AUDIT_RETRY_MAX_BACKOFF", "30"))  # seconds between retries, at most
+
+BACKPRESSURE_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+# errors caused by the rows themselves: retrying the same batch cannot succeed
+_DATA_ERRORS = (DataError, IntegrityError)
+
+# client-supplied strings are cut to fit, so strict SQL modes never reject a batch over them
+_ACTOR_LENGTH = AuditEvent.actor.type.length
+_IP_LENGTH = AuditEvent.ip.type.length
+_DETAIL_LENGTH = AuditEvent.detail.type.length
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """Bounded queue of audit events plus the writer task that empties it."""
+
+    def __init__(self, queue_size: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, backpressure: str = AUDIT_BACKPRESSURE,
+                 enabled: bool = AUDIT_ENABLED, max_backoff: float = AUDIT_RETRY_MAX_BACKOFF):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown audit backpressure policy: {backpressure}")
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.enabled = enabled
+        self.max_backoff = max_backoff
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._pending: List[dict] = []  # taken off the queue, not yet stored
+        self._failures = 0  # consecutive failed attempts at writing _pending
+        self._task: Optional[asyncio.Task] = None
+
+    def pending(self) -> int:
+        return len(self._pending) + (self._queue.qsize() if self._queue else 0)
+
+    def start(self):
+        # queue and event belong to the running loop, so they are made here rather than at import
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def record(self, action: str, actor: Optional[str] = None, target_id: Optional[int] = None,
+                     ip: Optional[str] = None, success: bool = True, detail: Optional[str] = None):
+        """Enqueue one event; only the `block` policy ever waits."""
+        if not self.enabled:
+            return
+        event = {"at": datetime.utcnow(), "action": action, "actor": actor[:_ACTOR_LENGTH] if actor else actor,
+                 "target_id": target_id, "ip": ip[:_IP_LENGTH] if ip else ip, "success": success,
+                 "detail": detail[:_DETAIL_LENGTH] if detail else None}
+        queue = self._queue
+        if queue is None:
+            self.dropped += 1  # no writer running (e.g. outside the app lifespan)
+            return
+        if self.backpressure == "block":
+            await queue.put(event)
+        else:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                if self.backpressure == "drop_newest":
+                    return
+                queue.get_nowait()
+                queue.put_nowait(event)
+        if queue.qsize() >= self.batch_size:
+            self._full.set()  # wake the writer before its interval is up
+
+    @asynccontextmanager
+    async def track(self, action: str, actor: Optional[str] = None, target_id: Optional[int] = None,
+                    ip: Optional[str] = None):
+        """Record `action` once the block ends: success, or the HTTP error it raised.
+
+        The yielded dict can be updated inside the block (e.g. the id of a user just created).
+        """
+        event = {"target_id": target_id, "detail": None}
+        try:
+            yield event
+        except HTTPException as e:
+            await self.record(action, actor, event["target_id"], ip, success=False, detail=str(e.detail))
+            raise
+        except Exception as e:
+            await self.record(action, actor, event["target_id"], ip, success=False, detail=type(e).__name__)
+            raise
+        await self.record(action, actor, event["target_id"], ip, success=True, detail=event["detail"])
+
+    def _take(self, limit: int):
+        while len(self._pending) < limit:
+            try:
+                self._pending.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _write_pending(self):
+        async with async_session_scope() as db:
+            await crud.insert_audit_events(db, self._pending)
+        self.written += len(self._pending)
+        self._pending = []
+
+    async def _write_one_by_one(self):
+        """Store the events of a rejected batch one at a time, dropping those rejected again.
+
+        Events leave _pending only once handled; any other error stops here and
+        leaves the rest in _pending for the caller to retry.
+        """
+        stored = lost = 0
+        try:
+            while self._pending:
+                try:
+                    async with async_session_scope() as db:
+                        await crud.insert_audit_events(db, self._pending[:1])
+                    stored += 1
+                except _DATA_ERRORS:
+                    lost += 1
+                    logger.exception("Dropped an audit event the database rejected: %r", self._pending[0])
+                self._pending.pop(0)
+        finally:
+            self.written += stored
+            self.dropped += lost
+
+    async def _flush_pending(self):
+        try:
+            await self._write_pending()
+        except _DATA_ERRORS:
+            self.write_errors += 1
+            logger.exception("Audit batch rejected, writing it one event at a time")
+            await self._write_one_by_one()
+
+    async def run(self):
+        while True:
+            if not self._pending:
+                self._pending.append(await self._queue.get())
+            # ✅ A full batch is written at once, a partial one after at most flush_interval
+            if len(self._pending) + self._queue.qsize() < self.batch_size:
+                self._full.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            self._take(self.batch_size)
+            try:
+                await self._flush_pending()
+                self._failures = 0
+            except Exception:
+                # kept in _pending and retried first, so a database outage loses nothing
+                self.write_errors += 1
+                self._failures += 1
+                delay = min(self.flush_interval * 2 ** (self._failures - 1), self.max_backoff)
+                logger.exception("Audit write failed (%d in a row), retrying in %.1fs", self._failures, delay)
+                await asyncio.sleep(delay)
+
+    async def stop(self) -> int:
+        """Stop the writer and store everything still queued; returns how many events were written."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._queue is None:
+            return 0
+        written = self.written
+        while True:
+            self._take(self.batch_size)
+            if not self._pending:
+                break
+            try:
+                await self._flush_pending()
+            except Exception:
+                # the database is unreachable and the worker is exiting: nothing left to wait for
+                self.write_errors += 1
+                lost = len(self._pending) + self._queue.qsize()
+                self.dropped += lost
+                logger.exception("Audit flush on shutdown failed, %d events lost", lost)
+                break
+        self._queue = self._full = None
+        self._pending = []
+        return self.written - written
+
+
+audit_log = AuditLog()
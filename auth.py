@@ -1,18 +1,47 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
 from fastapi import HTTPException
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
 from dotenv import load_dotenv
+from hashing import password_hasher
+from cache import TTLCache
+from metrics import track
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "mysecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# The first scheme hashes new passwords; the others are still accepted and
+# upgraded on the next successful login. Pick costs with `python calibrate_hashing.py`.
+PASSWORD_SCHEMES = [scheme.strip() for scheme in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if scheme.strip()]
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+def build_context(schemes: List[str] = PASSWORD_SCHEMES, bcrypt_rounds: int = BCRYPT_ROUNDS,
+                  argon2_time_cost: int = ARGON2_TIME_COST, argon2_memory_cost: int = ARGON2_MEMORY_COST,
+                  argon2_parallelism: int = ARGON2_PARALLELISM) -> CryptContext:
+    settings = {}
+    if "bcrypt" in schemes:
+        settings["bcrypt__rounds"] = bcrypt_rounds
+    if "argon2" in schemes:
+        from passlib.hash import argon2
+        if not argon2.has_backend():
+            raise RuntimeError("PASSWORD_SCHEMES includes argon2 but the 'argon2-cffi' package is not installed")
+        settings.update(argon2__time_cost=argon2_time_cost, argon2__memory_cost=argon2_memory_cost,
+                        argon2__parallelism=argon2_parallelism)
+    # deprecated="auto": hashes from any scheme but the first, or with other costs, need an update
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+pwd_context = build_context()
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -20,18 +49,50 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True when the hash uses an old scheme or cost; only parses the hash, no hashing."""
+    return pwd_context.needs_update(hashed_password)
+
+# Async variants run on the bounded hashing pool instead of the request thread
+async def hash_password_async(password: str) -> str:
+    with track("hash", "hash"):
+        return await password_hasher.run(hash_password, password)
+
+async def hash_passwords_async(passwords: List[str]) -> List[str]:
+    with track("hash", "hash_batch"):
+        return await password_hasher.map(hash_password, passwords)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    with track("hash", "verify"):
+        return await password_hasher.run(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Already-verified tokens, keyed by a digest of the token and evicted at its `exp`
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 # Function to decode JWT token
 def decode_token(token: str):
+    with track("jwt"):
+        return _decode_token(token)
+
+def _decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is not None and payload["exp"] > time.time():
+        return dict(payload)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.InvalidTokenError:
+    except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+    if "exp" in payload:
+        token_cache.set(key, dict(payload), expires_in=payload["exp"] - time.time())
+    return payload
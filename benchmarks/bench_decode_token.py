@@ -0,0 +1,37 @@
+"""Micro-benchmark: cost of auth.decode_token with and without the verified-token cache.
+
+Run from the project root:
+
+    python -m benchmarks.bench_decode_token --iterations 20000
+"""
+import argparse
+import timeit
+
+import auth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = auth.create_access_token(data={"sub": "admin"})
+
+    def uncached():
+        auth.token_cache.clear()
+        auth.decode_token(token)
+
+    def cached():
+        auth.decode_token(token)
+
+    auth.decode_token(token)  # warm the cache for the cached run
+    cold = min(timeit.repeat(uncached, number=args.iterations, repeat=3)) / args.iterations
+    warm = min(timeit.repeat(cached, number=args.iterations, repeat=3)) / args.iterations
+
+    print(f"decode_token uncached: {cold * 1e6:8.2f} us/call")
+    print(f"decode_token cached:   {warm * 1e6:8.2f} us/call")
+    print(f"saving per request:    {(cold - warm) * 1e6:8.2f} us ({cold / warm:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Micro-benchmark: typeahead lookups on the in-memory prefix index.
+
+Run from the project root:
+
+    python -m benchmarks.bench_search --users 100000
+"""
+import argparse
+import random
+import string
+import time
+import timeit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from models import RoleEnum
+    from search import UserSearchIndex
+
+    rng = random.Random(args.seed)
+    names = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12))) + str(i) for i in range(args.users)]
+    rows = [(i, name, f"{name}@example.com", f"Ward {i % 200}", RoleEnum.Doctor) for i, name in enumerate(names)]
+
+    index = UserSearchIndex()
+    start = time.perf_counter()
+    index.load(rows)
+    print(f"build {args.users} users:        {(time.perf_counter() - start) * 1000:8.1f} ms")
+
+    # one to five keystrokes of real usernames, plus department prefixes matching thousands of users
+    prefixes = [rng.choice(names)[:rng.randint(1, 5)] for _ in range(200)] + ["w", "ward 1"]
+    cursor = iter(range(10 ** 9))
+
+    def lookup():
+        index.search(prefixes[next(cursor) % len(prefixes)], limit=10)
+
+    per_call = min(timeit.repeat(lookup, number=args.iterations, repeat=3)) / args.iterations
+    print(f"search, limit 10:            {per_call * 1e6:8.1f} us/lookup")
+
+    start = time.perf_counter()
+    for i in range(1000):
+        index.add((args.users + i, f"new{i}", f"new{i}@example.com", "Ward 1", RoleEnum.Doctor))
+    print(f"incremental add:             {(time.perf_counter() - start) * 1000:8.3f} us/user")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: serializing and serving a 10k-user listing.
+
+Run from the project root:
+
+    python -m benchmarks.bench_user_listing --users 10000
+
+Compares the response_model path (validate every row through UserResponse,
+then dump) with serialization.dump_users on the same rows, then times a
+full walk of the listing through GET /users pages in-process: cold (encoded
+listing cache cleared) and warm, uncompressed and gzip.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import timeit
+
+
+async def walk_listing(page_size, accept_encoding="identity", cold=False):
+    """Fetch every page of /users; returns (seconds, users seen, bytes received)."""
+    import httpx
+    from main import app
+    from response_compression import listing_cache
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.post("/login", data={"username": "admin", "password": "Admin@123"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}", "Accept-Encoding": accept_encoding}
+        await client.get("/users", params={"limit": 1}, headers=headers)  # warm caches
+        if cold:
+            listing_cache.clear()
+        start, seen, received, cursor = time.perf_counter(), 0, 0, None
+        while True:
+            params = {"limit": page_size}
+            if cursor:
+                params["cursor"] = cursor
+            response = await client.get("/users", params=params, headers=headers)
+            seen += len(response.json())
+            received += response.num_bytes_downloaded
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                return time.perf_counter() - start, seen, received
+
+
+async def run(args):
+    from typing import List
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from benchmarks.load_test import seed_users
+    from database import get_engine
+    from main import app
+    from schemas import UserResponse
+    import crud
+    import serialization
+
+    async with app.router.lifespan_context(app):
+        seed_users(args.users)
+        with get_engine().connect() as conn:
+            rows = conn.execute(select(*crud.USER_RESPONSE_COLUMNS)).all()
+
+        adapter = TypeAdapter(List[UserResponse])
+
+        def validated():
+            # what FastAPI does for response_model=List[UserResponse]
+            return adapter.dump_json(adapter.validate_python([row._mapping for row in rows]))
+
+        def fast():
+            return serialization.dump_users(rows)
+
+        assert validated() == fast(), "fast path output differs from response_model output"
+        before = min(timeit.repeat(validated, number=1, repeat=args.repeat))
+        after = min(timeit.repeat(fast, number=1, repeat=args.repeat))
+        print(f"serialize {len(rows)} users, response_model: {before * 1000:9.2f} ms")
+        print(f"serialize {len(rows)} users, fast path:      {after * 1000:9.2f} ms ({before / after:.1f}x faster)")
+
+        for accept_encoding in ("identity", "gzip"):
+            for cold in (True, False):
+                best = min([await walk_listing(args.page_size, accept_encoding, cold) for _ in range(args.repeat)])
+                print(f"GET /users walk, {best[1]} users in pages of {args.page_size}, {accept_encoding:8}"
+                      f" {'cold' if cold else 'warm'}: {best[0] * 1000:9.2f} ms, {best[2] / 1024:8.1f} KiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="healthcare-bench-")
+    # must be set before the app modules are imported
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BCRYPT_ROUNDS"] = "4"
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
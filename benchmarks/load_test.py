@@ -0,0 +1,203 @@
+"""Load-test and benchmark suite for the auth service.
+
+Runs the real app in-process (httpx ASGI transport, app lifespan included)
+against a throwaway SQLite database, so results are reproducible on any host.
+
+    python -m benchmarks.load_test                           # all scenarios
+    python -m benchmarks.load_test --scenarios login_storm --requests 500
+    python -m benchmarks.load_test --save benchmarks/baseline.json
+    python -m benchmarks.load_test --compare benchmarks/baseline.json --tolerance 0.2
+
+Each scenario reports throughput and p50/p95/p99 latency. With --compare the
+run exits non-zero when throughput drops, or p95 rises, by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SCENARIOS = ("login_storm", "token_reads", "status_polling", "mixed_admin_writes")
+PASSWORD = "Bench@1234"
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(samples)))
+    return samples[min(rank, len(samples)) - 1]
+
+
+def summarize(name, latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def drive(name, make_request, requests, concurrency):
+    """Issue `requests` calls of `make_request(i)` with `concurrency` in flight."""
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(name, latencies, errors, time.perf_counter() - start)
+
+
+def seed_users(count):
+    from sqlalchemy import insert
+    from auth import hash_password
+    from database import get_engine
+    from models import RoleEnum, User
+
+    password = hash_password(PASSWORD)  # one hash reused: seeding is not what we measure
+    roles = [RoleEnum.Doctor, RoleEnum.Employee]
+    rows = [
+        {"username": f"bench{i}", "email": f"bench{i}@example.com", "password": password,
+         "department": f"Ward {i % 20}", "role": roles[i % 2]}
+        for i in range(count)
+    ]
+    with get_engine().begin() as conn:
+        conn.execute(insert(User), rows)
+    return [row["username"] for row in rows]
+
+
+async def run(args):
+    import httpx
+    from main import app
+
+    results = []
+    async with app.router.lifespan_context(app):
+        usernames = seed_users(args.users)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.post("/login", data={"username": "admin", "password": "Admin@123"})
+            admin = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            rng = random.Random(args.seed)
+
+            async def login_storm(i):
+                return await client.post("/login", data={"username": rng.choice(usernames), "password": PASSWORD})
+
+            async def token_reads(i):
+                if i % 2:
+                    return await client.get("/users", params={"limit": 50}, headers=admin)
+                return await client.get(f"/user/username/{rng.choice(usernames)}", headers=admin)
+
+            async def status_polling(i):
+                if i % 4 == 0:
+                    return await client.post("/users/status", json={"usernames": rng.sample(usernames, min(50, len(usernames)))}, headers=admin)
+                return await client.get(f"/user/status/{rng.choice(usernames)}")
+
+            async def mixed_admin_writes(i):
+                if i % 3 == 0:
+                    user_id = rng.randint(2, args.users + 1)
+                    return await client.put(f"/user/update/{user_id}", json={"department": f"Ward {i % 20}"}, headers=admin)
+                if i % 3 == 1:
+                    return await client.get("/users", params={"limit": 20, "department": f"Ward {i % 20}"}, headers=admin)
+                return await client.get(f"/user/username/{rng.choice(usernames)}", headers=admin)
+
+            scenarios = {
+                "login_storm": login_storm,
+                "token_reads": token_reads,
+                "status_polling": status_polling,
+                "mixed_admin_writes": mixed_admin_writes,
+            }
+            for name in args.scenarios:
+                results.append(await drive(name, scenarios[name], args.requests, args.concurrency))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a saved baseline, as human readable lines."""
+    previous = {entry["scenario"]: entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        before = previous.get(entry["scenario"])
+        if before is None:
+            continue
+        if entry["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{entry['scenario']}: throughput {before['throughput_rps']} -> {entry['throughput_rps']} rps")
+        if entry["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{entry['scenario']}: p95 {before['p95_ms']} -> {entry['p95_ms']} ms")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'scenario':<20}{'requests':>9}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<20}{r['requests']:>9}{r['errors']:>8}{r['throughput_rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the auth service in-process.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=500, help="users seeded before the run")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="bcrypt cost for the run (production uses 12)")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="healthcare-bench-")
+    # must be set before the app modules are imported (worker processes inherit them too)
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("LOGIN_RATE_LIMIT_ENABLED", "false")  # measure the service, not the throttle
+
+    results = asyncio.run(run(args))
+    print_table(results)
+
+    report = {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("save", "compare")},
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print("no regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Pick password hashing costs for this host.
+
+    python calibrate_hashing.py --target-ms 250
+    python calibrate_hashing.py --scheme argon2 --target-ms 250 --memory-mib 64
+
+Times a verify at increasing cost and prints the highest setting whose verify
+stays within the target, as lines for .env. Existing hashes are upgraded to
+the new cost on each user's next login, so no password resets are needed.
+"""
+import argparse
+import statistics
+import time
+from typing import Tuple
+from hashing import PASSWORD_HASH_WORKERS
+
+PASSWORD = "Calibrate@123"
+
+
+def verify_seconds(handler, samples: int) -> float:
+    """Median time of one verify with the given (configured) passlib handler."""
+    hashed = handler.hash(PASSWORD)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.verify(PASSWORD, hashed)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate_bcrypt(target: float, samples: int = 3, min_rounds: int = 4, max_rounds: int = 16) -> Tuple[int, float]:
+    """Highest bcrypt rounds whose verify takes at most `target` seconds."""
+    from passlib.hash import bcrypt
+
+    if samples < 1 or min_rounds > max_rounds:
+        raise ValueError(f"Nothing to time: rounds {min_rounds}..{max_rounds}, {samples} samples")
+    best = None
+    for rounds in range(min_rounds, max_rounds + 1):
+        elapsed = verify_seconds(bcrypt.using(rounds=rounds), samples)
+        if elapsed > target:
+            break  # every extra round doubles the cost
+        best = (rounds, elapsed)
+    return best or (min_rounds, elapsed)
+
+
+def calibrate_argon2(target: float, memory_kib: int, parallelism: int, samples: int = 3,
+                     max_time_cost: int = 20) -> Tuple[int, float]:
+    """Highest argon2 time_cost at a fixed memory cost whose verify takes at most `target` seconds."""
+    from passlib.hash import argon2
+
+    if not argon2.has_backend():
+        raise SystemExit("argon2 needs the 'argon2-cffi' package: pip install argon2-cffi")
+    if samples < 1 or max_time_cost < 1:
+        raise ValueError(f"Nothing to time: time_cost 1..{max_time_cost}, {samples} samples")
+    best = None
+    for time_cost in range(1, max_time_cost + 1):
+        handler = argon2.using(time_cost=time_cost, memory_cost=memory_kib, parallelism=parallelism)
+        elapsed = verify_seconds(handler, samples)
+        if elapsed > target:
+            break
+        best = (time_cost, elapsed)
+    return best or (1, elapsed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scheme", choices=("bcrypt", "argon2"), default="bcrypt")
+    parser.add_argument("--target-ms", type=float, default=250, help="verify time to aim for on this host")
+    parser.add_argument("--memory-mib", type=int, default=64, help="argon2 memory cost")
+    parser.add_argument("--parallelism", type=int, default=4, help="argon2 lanes")
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args(argv)
+    for name in ("target_ms", "memory_mib", "parallelism", "samples"):
+        if getattr(args, name) <= 0:
+            parser.error(f"--{name.replace('_', '-')} must be positive")
+
+    target = args.target_ms / 1000
+    if args.scheme == "bcrypt":
+        rounds, elapsed = calibrate_bcrypt(target, args.samples)
+        lines = ["PASSWORD_SCHEMES=bcrypt", f"BCRYPT_ROUNDS={rounds}"]
+    else:
+        memory_kib = args.memory_mib * 1024
+        time_cost, elapsed = calibrate_argon2(target, memory_kib, args.parallelism, args.samples)
+        # bcrypt stays listed so existing hashes keep working until they are upgraded
+        lines = ["PASSWORD_SCHEMES=argon2,bcrypt", f"ARGON2_TIME_COST={time_cost}",
+                 f"ARGON2_MEMORY_COST={memory_kib}", f"ARGON2_PARALLELISM={args.parallelism}"]
+
+    print(f"verify takes {elapsed * 1000:.1f} ms (target {args.target_ms:g} ms); "
+          f"~{PASSWORD_HASH_WORKERS / elapsed:.0f} logins/s with {PASSWORD_HASH_WORKERS} hash workers")
+    print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    main()
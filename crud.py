@@ -1,54 +1,218 @@
-from sqlalchemy.orm import Session
-from models import User
-from schemas import UserCreate
-from security import get_password_hash, verify_password
-
-def get_user_by_email(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
-
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
-
-def get_all_users(db: Session):
-    return db.query(User).all()
-
-def create_user(db: Session, user: UserCreate):
-    hashed_password = get_password_hash(user.password)
-    db_user = User(
-        username=user.username,
-        email=user.email,
-        hashed_password=hashed_password,
-        role=user.role
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
-
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user_by_username(db, username)
-    if not user or not verify_password(password, user.hashed_password):
-        return None
-    return user
+"""Repository layer: every query the routes issue, one round-trip where the database allows it.
+
+Functions take the request session (AsyncSession or database.ThreadedSession)
+and return plain rows rather than ORM objects; user rows are in
+USER_RESPONSE_COLUMNS order, ready for serialization.dump_users.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from fastapi import HTTPException
+from sqlalchemy import delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from models import AuditEvent, User, RoleEnum
+
+# columns needed by UserResponse, selected without hydrating ORM objects
+USER_RESPONSE_COLUMNS = (User.id, User.username, User.email, User.department, User.role, User.last_login, User.is_online)
+PRINCIPAL_COLUMNS = (User.id, User.username, User.role, User.department)
+STATUS_COLUMNS = (User.username, User.is_online, User.last_login)
+# a prefix of USER_RESPONSE_COLUMNS, so user rows can feed the search index as they are
+SEARCH_COLUMNS = (User.id, User.username, User.email, User.department, User.role)
+
+
+def _dialect(db):
+    return db.bind.dialect
+
+
+async def _write(db, statement, returning: bool):
+    """Execute and commit one write; unique violations become a 400."""
+    try:
+        result = await db.execute(statement)
+        row = result.first() if returning else None
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Username or email already exists")
+    return result, row
+
+
+def filter_users(query, role: Optional[RoleEnum] = None, department: Optional[str] = None, is_online: Optional[bool] = None):
+    if role is not None:
+        query = query.where(User.role == role)
+    if department is not None:
+        query = query.where(User.department == department)
+    if is_online is not None:
+        query = query.where(User.is_online == is_online)
+    return query
+
+
+async def get_principal_row(db, username: str):
+    return (await db.execute(select(*PRINCIPAL_COLUMNS).where(User.username == username))).first()
+
+
+async def get_credentials(db, username: str):
+    """id, username and password hash for a login attempt."""
+    return (await db.execute(select(User.id, User.username, User.password).where(User.username == username))).first()
+
+
+async def get_user_by_id(db, user_id: int):
+    return (await db.execute(select(*USER_RESPONSE_COLUMNS).where(User.id == user_id))).first()
+
+
+# single-user lookups append updated_at after the response columns, for the ETag
+async def get_user_by_email(db, email: str):
+    return (await db.execute(select(*USER_RESPONSE_COLUMNS, User.updated_at).where(User.email == email))).first()
+
+
+async def get_user_by_username(db, username: str):
+    return (await db.execute(select(*USER_RESPONSE_COLUMNS, User.updated_at).where(User.username == username))).first()
+
+
+async def get_user_version(db, email: Optional[str] = None, username: Optional[str] = None):
+    """(id, updated_at) only, enough to answer If-None-Match."""
+    key = User.email == email if email is not None else User.username == username
+    return (await db.execute(select(User.id, User.updated_at).where(key))).first()
+
+
+async def collection_version(db):
+    """(count, max(updated_at), max(id)) of the users table; every write changes it."""
+    return tuple((await db.execute(select(func.count(User.id), func.max(User.updated_at), func.max(User.id)))).one())
+
+
+async def profile_version(db):
+    """(count, max(id), max(profile_updated_at)): changes on admin writes, not on logins."""
+    return tuple((await db.execute(
+        select(func.count(User.id), func.max(User.id), func.max(User.profile_updated_at))
+    )).one())
+
+
+async def list_users(db, limit: int, cursor: Optional[int] = None, order: str = "asc", **filters):
+    """One keyset page ordered by id; fetches one extra row to tell if a next page exists."""
+    query = select(*USER_RESPONSE_COLUMNS)
+    if cursor is not None:
+        query = query.where(User.id > cursor if order == "asc" else User.id < cursor)
+    query = filter_users(query, **filters)
+    query = query.order_by(User.id.asc() if order == "asc" else User.id.desc()).limit(limit + 1)
+    return (await db.execute(query)).all()
+
+
+def export_query(**filters):
+    return filter_users(select(*USER_RESPONSE_COLUMNS), **filters).order_by(User.id)
 
-def update_user(db: Session, user_id: int, updated_user: UserCreate):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+
+async def create_user(db, values: dict):
+    """INSERT ... RETURNING where supported, otherwise INSERT then read back by primary key."""
+    statement = insert(User).values(**values)
+    if _dialect(db).insert_returning:
+        _, row = await _write(db, statement.returning(*USER_RESPONSE_COLUMNS), returning=True)
+        return row
+    result, _ = await _write(db, statement, returning=False)
+    return await get_user_by_id(db, result.inserted_primary_key[0])
+
+
+async def update_user(db, user_id: int, values: dict):
+    """Single UPDATE keyed by id; returns the updated row, or None when no such user."""
+    if not values:
+        return await get_user_by_id(db, user_id)
+    values = {**values, "profile_updated_at": datetime.utcnow()}
+    # no ORM objects are kept in the session, so there is nothing to synchronize
+    statement = update(User).where(User.id == user_id).values(**values).execution_options(synchronize_session=False)
+    if _dialect(db).update_returning:
+        _, row = await _write(db, statement.returning(*USER_RESPONSE_COLUMNS), returning=True)
+        return row
+    # rowcount is "matched rows" (the MySQL dialects enable FOUND_ROWS)
+    result, _ = await _write(db, statement, returning=False)
+    if result.rowcount == 0:
         return None
+    return await get_user_by_id(db, user_id)
+
+
+async def replace_password_hash(db, user_id: int, old_hash: str, new_hash: str) -> bool:
+    """Swap in an upgraded hash unless the password changed meanwhile."""
+    result = await db.execute(
+        update(User)
+        .where(User.id == user_id, User.password == old_hash)
+        .values(password=new_hash)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def delete_user(db, user_id: int) -> bool:
+    """Single DELETE keyed by id; False when no such user."""
+    result = await db.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def get_status(db, username: str):
+    return (await db.execute(select(*STATUS_COLUMNS).where(User.username == username))).first()
+
+
+async def get_statuses(db, usernames: Optional[Iterable[str]] = None, department: Optional[str] = None):
+    query = select(*STATUS_COLUMNS)
+    if department:
+        query = query.where(User.department == department)
+    if usernames:
+        query = query.where(User.username.in_(list(usernames)))
+    return (await db.execute(query)).all()
+
+
+async def search_entries(db, changed_since: Optional[datetime] = None):
+    """Searchable columns of every user, or of those whose profile changed since `changed_since`."""
+    query = select(*SEARCH_COLUMNS)
+    if changed_since is not None:
+        query = query.where(User.profile_updated_at >= changed_since)
+    return (await db.execute(query)).all()
+
+
+async def user_ids(db) -> List[int]:
+    return list((await db.execute(select(User.id))).scalars())
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+async def users_with_prefix(db, field: str, prefix: str, limit: int, exclude: Iterable[int] = ()):
+    """Users whose `field` starts with `prefix`; a constant-prefix LIKE can use the column's index."""
+    column = getattr(User, field)
+    query = select(*SEARCH_COLUMNS).where(column.like(_like_prefix(prefix), escape="\\"))
+    if exclude:
+        query = query.where(User.id.not_in(list(exclude)))
+    return (await db.execute(query.order_by(column, User.id).limit(limit))).all()
+
+
+async def expire_sessions(db, logged_in_before: datetime) -> int:
+    """Mark users offline whose last login is older than a token lifetime, in one UPDATE."""
+    result = await db.execute(
+        update(User)
+        .where(User.is_online == True, User.last_login < logged_in_before)  # noqa: E712
+        .values(is_online=False)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def find_taken(db, usernames: Iterable[str], emails: Iterable[str]):
+    """Existing (username, email) pairs clashing with any of the given values, in one query."""
+    return (await db.execute(
+        select(User.username, User.email).where(or_(User.username.in_(list(usernames)), User.email.in_(list(emails))))
+    )).all()
+
+
+async def insert_users(db, rows: List[dict]) -> Dict[str, int]:
+    """Multi-row INSERT in one transaction; returns username -> id for the new rows."""
+    await db.execute(insert(User), rows)
+    await db.commit()
+    ids = await db.execute(
+        select(User.username, User.id).where(User.username.in_([row["username"] for row in rows]))
+    )
+    return dict(ids.all())
+
 
-    user.username = updated_user.username
-    user.email = updated_user.email
-    user.role = updated_user.role
-    user.hashed_password = get_password_hash(updated_user.password)
-    
-    db.commit()
-    db.refresh(user)
-    return user
-
-def delete_user(db: Session, user_id: int):
-    user = db.query(User).filter(User.id == user_id).first()
-    if user:
-        db.delete(user)
-        db.commit()
-        return True
-    return False
+async def insert_audit_events(db, events: List[dict]):
+    """One multi-row INSERT (INSERT ... VALUES (...), (...), ...) for a batch of audit events."""
+    await db.execute(insert(AuditEvent).values(events))
+    await db.commit()
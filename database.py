@@ -1,21 +1,267 @@
-from sqlalchemy import create_engine, Column, Integer, String, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Enum, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi.concurrency import run_in_threadpool
 import os
+import threading
+from contextlib import asynccontextmanager
+import time
 from dotenv import load_dotenv
+from metrics import instrument_engine
 
 # load dato from .env
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "mysql+pymysql://root:@localhost/healthcare")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# connection pool settings (per engine, per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # keep below MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# async driver -> sync driver used for DDL, seeding and scripts
+SYNC_DRIVERS = {"aiomysql": "pymysql", "asyncmy": "pymysql", "aiosqlite": "pysqlite"}
+
+def is_async_url(url: str) -> bool:
+    return make_url(url).get_driver_name() in SYNC_DRIVERS
+
+def to_sync_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = SYNC_DRIVERS.get(parsed.get_driver_name())
+    if driver is None:
+        return url
+    return parsed.set(drivername=f"{parsed.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+class PoolStatsMixin:
+    """Counts checkouts, time spent waiting for a connection and checkout timeouts."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+        self.checkout_timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            with self._stats_lock:
+                self.checkouts += 1
+                self.checkout_wait += time.perf_counter() - start
+                self.checkout_timeouts += timed_out
+
+
+class InstrumentedQueuePool(PoolStatsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(PoolStatsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url: str) -> dict:
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}  # in-memory SQLite needs its single shared connection
+    return {
+        "poolclass": InstrumentedAsyncQueuePool if is_async_url(url) else InstrumentedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def pool_stats(pool) -> dict:
+    stats = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(),
+                     overflow=pool.overflow(), max_overflow=pool._max_overflow)
+    if isinstance(pool, PoolStatsMixin):
+        stats.update(checkouts=pool.checkouts, checkout_wait_seconds=round(pool.checkout_wait, 6),
+                     checkout_timeouts=pool.checkout_timeouts)
+    return stats
+
+# ✅ Async mode is opt-in: pick an async driver in DATABASE_URL (mysql+aiomysql, sqlite+aiosqlite)
+ASYNC_MODE = is_async_url(DATABASE_URL)
+
 Base = declarative_base()
 
+# Engines are built on first use, so importing the app never loads a driver or touches the database
+_engine = None
+_async_engine = None
+_async_sessionmaker = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                url = to_sync_url(DATABASE_URL)
+                _engine = create_engine(url, **pool_options(url))
+                instrument_engine(_engine)
+    return _engine
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                from sqlalchemy.ext.asyncio import create_async_engine
+                _async_engine = create_async_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+                instrument_engine(_async_engine.sync_engine)
+    return _async_engine
+
+def get_async_sessionmaker():
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_sessionmaker = async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker
+
+def __getattr__(name):
+    # `from database import engine` keeps working and builds the engine at that point
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine() if ASYNC_MODE else None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySessionMaker(sessionmaker):
+    """sessionmaker bound to the sync engine at call time rather than at import."""
+
+    def __call__(self, **local_kw):
+        return super().__call__(**{"bind": get_engine(), **local_kw})
+
+
+SessionLocal = LazySessionMaker(autocommit=False, autoflush=False)
+
+# engine whose pool serves the HTTP handlers
+def request_engine():
+    return get_async_engine().sync_engine if ASYNC_MODE else get_engine()
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+class ThreadedSession:
+    """AsyncSession-compatible wrapper that runs a sync Session's I/O on the threadpool.
+
+    Lets the async handlers run unchanged on a sync driver: the event loop is only
+    left for the database call itself, not for the whole request.
+    """
+
+    def __init__(self, sync_session):
+        self.sync_session = sync_session
+
+    @property
+    def bind(self):
+        return self.sync_session.bind
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, execution_options=None, **kw):
+        # rows are fetched on the worker thread, like AsyncSession does
+        options = {**(execution_options or {}), "prebuffer_rows": True}
+        return await run_in_threadpool(
+            self.sync_session.execute, statement, params, execution_options=options, **kw
+        )
+
+    async def scalar(self, statement, params=None, **kw):
+        result = await self.execute(statement, params, **kw)
+        return result.scalar()
+
+    async def scalars(self, statement, params=None, **kw):
+        result = await self.execute(statement, params, **kw)
+        return result.scalars()
+
+    async def stream(self, statement, params=None, execution_options=None, **kw):
+        # server-side cursor: rows are pulled batch by batch through partitions()
+        options = {**(execution_options or {}), "stream_results": True}
+        result = await run_in_threadpool(
+            self.sync_session.execute, statement, params, execution_options=options, **kw
+        )
+        return ThreadedStreamResult(result)
+
+    async def get(self, entity, ident, **kw):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kw)
+
+    async def delete(self, instance):
+        self.sync_session.delete(instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class ThreadedStreamResult:
+    """Async iteration over a streaming sync Result, mirroring AsyncResult.partitions()."""
+
+    def __init__(self, result):
+        self._result = result
+
+    async def partitions(self, size=None):
+        try:
+            while True:
+                partition = await run_in_threadpool(self._result.fetchmany, size)
+                if not partition:
+                    break
+                yield partition
+        finally:
+            await run_in_threadpool(self._result.close)
+
+
+@asynccontextmanager
+async def async_session_scope(bind=None):
+    """Session on the primary, or on `bind` (e.g. a replica engine of the same mode)."""
+    options = {"bind": bind} if bind is not None else {}
+    if ASYNC_MODE:
+        async with get_async_sessionmaker()(**options) as db:
+            yield db
+    else:
+        db = ThreadedSession(SessionLocal(expire_on_commit=False, **options))
+        try:
+            yield db
+        finally:
+            await db.close()
+
+# session type handed to the async handlers
+if ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import AsyncSession as DbSession
+else:
+    DbSession = ThreadedSession
+
+async def get_async_db():
+    async with async_session_scope() as db:
+        yield db
@@ -0,0 +1,45 @@
+"""ETags and If-None-Match handling for the user lookups and listings.
+
+Single users are versioned by (id, updated_at). A listing is versioned by
+the whole table's (count, max(updated_at), max(id)), read from indexes, plus
+the query string. Any insert, update or delete changes that version, so a
+stale page is never answered with 304.
+"""
+import hashlib
+from typing import Iterable, Optional
+from fastapi import Response
+
+# polling clients must revalidate every time, but may keep the body
+CACHE_CONTROL = "private, no-cache"
+
+
+def _tag(*parts) -> str:
+    digest = hashlib.blake2b("|".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    # weak: the same representation may be sent compressed or not
+    return f'W/"{digest}"'
+
+
+def user_etag(user_id: int, updated_at) -> str:
+    return _tag("user", user_id, updated_at)
+
+
+def collection_etag(version: Iterable, query: str = "") -> str:
+    return _tag("users", *version, query)
+
+
+def matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as RFC 9110 requires for If-None-Match."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
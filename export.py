@@ -0,0 +1,42 @@
+import csv
+import enum
+import io
+from datetime import datetime
+from typing import Iterable, Sequence
+from serialization import dumps
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_ndjson(columns: Sequence[str], rows: Iterable[Sequence]) -> bytes:
+    """One JSON object per line, one line per row."""
+    return b"".join(dumps(dict(zip(columns, row))) + b"\n" for row in rows)
+
+
+def encode_csv(rows: Iterable[Sequence]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if value is None else _plain(value) for value in row])
+    return buffer.getvalue().encode()
+
+
+def encode_rows(fmt: str, columns: Sequence[str], rows: Iterable[Sequence]) -> bytes:
+    if fmt == "csv":
+        return encode_csv(rows)
+    return encode_ndjson(columns, rows)
+
+
+def encode_header(fmt: str, columns: Sequence[str]) -> bytes:
+    return encode_csv([columns]) if fmt == "csv" else b""
@@ -0,0 +1,108 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "process" runs bcrypt in worker processes, "thread" in a dedicated thread pool
+# (bcrypt releases the GIL while hashing, so threads also scale across cores)
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "process")
+# per web worker: uvicorn's WEB_CONCURRENCY workers each start a pool, so the cores are shared between them
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+PASSWORD_HASH_QUEUE_SIZE = int(os.getenv("PASSWORD_HASH_QUEUE_SIZE", "64"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "1"))
+
+
+class PasswordHasher:
+    """Bounded executor for password hashing, kept off the request threadpool.
+
+    At most ``workers + queue_size`` jobs are admitted at once; beyond that the
+    caller gets a 503 with ``Retry-After`` instead of queueing without limit.
+    """
+
+    def __init__(self, kind: str = PASSWORD_HASH_EXECUTOR, workers: int = PASSWORD_HASH_WORKERS,
+                 queue_size: int = PASSWORD_HASH_QUEUE_SIZE, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown password hash executor: {kind}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.retry_after = retry_after
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_size
+
+    def _get_executor(self) -> Executor:
+        # created on first use so importing the app never forks workers
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    def _admit(self):
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, please retry",
+                headers={"Retry-After": str(self.retry_after)},
+            )
+        self.pending += 1
+
+    async def run(self, fn: Callable, *args):
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def map(self, fn: Callable, items: Iterable) -> list:
+        """Run ``fn`` over ``items`` in parallel as a single admitted job.
+
+        At most ``workers`` items are in flight, so interactive logins queued
+        behind a bulk job wait for one hash, not for the whole batch.
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        slots = asyncio.Semaphore(self.workers)
+
+        async def run_one(item):
+            async with slots:
+                return await loop.run_in_executor(executor, fn, item)
+
+        try:
+            return await asyncio.gather(*(run_one(item) for item in items))
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -1,35 +1,60 @@
-from datetime import datetime
-from fastapi import FastAPI, Depends, HTTPException, Security, status
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine, Base, get_db
-from models import User, RoleEnum
-from schemas import UserCreate, UserLogin, UserResponse, UserUpdate
-from auth import hash_password, verify_password, create_access_token, decode_token
-from typing import List, Optional
+import asyncio
+import os
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta
+from fastapi import BackgroundTasks, Body, FastAPI, Depends, File, Header, HTTPException, Query, Request, Security, UploadFile, status
+from database import DbSession, async_session_scope, get_async_db, pool_stats, request_engine
+from export import EXPORT_FORMATS, encode_header, encode_rows
+from models import RoleEnum
+import crud
+from schemas import BulkRegisterResponse, StatusBatchRequest, UserCreate, UserLogin, UserResponse, UserSearchResult, UserStatus, UserUpdate
+from provisioning import parse_csv, provision_users
+from serialization import dump_users, dumps, user_response
+from response_compression import CompressionMiddleware, compress, encoded_response, listing_cache, negotiate
+from search import SEARCH_FIELDS, SEARCH_INDEX_ENABLED, SEARCH_INDEX_REFRESH_INTERVAL, search_database, search_index
+from etag import collection_etag, etag_headers, matches, not_modified, user_etag
+from presence import presence
+from auth import ACCESS_TOKEN_EXPIRE_MINUTES, hash_password_async, verify_password_async, needs_rehash, create_access_token, decode_token, token_cache
+from hashing import password_hasher
+from throttle import login_throttle
+from principals import Principal, principal_cache, invalidate_principal
+from replicas import READ_YOUR_WRITES_COOKIE, get_read_db, read_session_scope, replica_router
+from audit import audit_log
+from typing import Any, Dict, List, Literal, Optional
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware  
-
-Base.metadata.create_all(bind=engine)
-
-def create_default_admin():
-    db = SessionLocal()
-    admin_exists = db.query(User).filter(User.role == RoleEnum.Admin).first()
-    if not admin_exists:
-        default_admin = User(
-            username="admin",
-            email="admin@example.com",
-            password=hash_password("Admin@123"),  # encrypt password
-            department="Administration",
-            role=RoleEnum.Admin
-        )
-        db.add(default_admin)
-        db.commit()
-        print("✅ Default Admin Created: username=admin, password=Admin@123")
-    db.close()
-
-create_default_admin()
-
-app = FastAPI()
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from startup import run_startup
+from metrics import MetricsMiddleware, gauge_sources, render_prometheus
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ✅ Schema and admin seeding run here, not at import time
+    await run_in_threadpool(run_startup)
+    login_throttle.store  # fail fast on a misconfigured shared throttle store
+    tasks = [
+        asyncio.create_task(presence.run()),
+        # ✅ Expired sessions go offline here, never in the auth dependency
+        asyncio.create_task(presence.run_sweeper(timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))),
+    ]
+    audit_log.start()  # ✅ Audit events are written in batches by a background writer
+    if SEARCH_INDEX_ENABLED:
+        await search_index.rebuild()  # ✅ Typeahead is served from memory from the first request
+        if SEARCH_INDEX_REFRESH_INTERVAL > 0:
+            tasks.append(asyncio.create_task(search_index.run()))
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await presence.flush()  # ✅ Write back presence changes still in memory
+    await audit_log.stop()  # ✅ Store audit events still queued
+    password_hasher.shutdown()
+    await replica_router.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware)  # ✅ gzip (zstd/br when installed) above COMPRESSION_MIN_SIZE
 
 #  Allow requests from Angular frontend
 origins = [
@@ -45,145 +70,384 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  #  Allow all methods (GET, POST, PUT, DELETE)
     allow_headers=["*"],  #  Allow all headers
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag"],  #  Let the frontend read the pagination cursor, timings and ETags
 )
+app.add_middleware(MetricsMiddleware)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
 # ** check from current user **
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: DbSession = Depends(get_async_db)):
     payload = decode_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = db.query(User).filter(User.username == payload["sub"]).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    principal = principal_cache.get(payload["sub"])
+    if principal is None:
+        row = await crud.get_principal_row(db, payload["sub"])
+        if not row:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal = Principal.from_user(row)
+        principal_cache.set(principal.username, principal)
 
-    # If the token is expired, mark user as offline
-    if payload.get("exp") < datetime.utcnow().timestamp():
-        user.is_online = False
-        db.commit()
-        raise HTTPException(status_code=401, detail="Session expired, please login again")
+    # expired tokens never get here (decode_token rejects them); the session sweeper marks them offline
+    return principal
 
-    return user
+def client_host(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
 
 # ** just Admin can add new user **
 @app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if current_user.role != RoleEnum.Admin:
-        raise HTTPException(status_code=403, detail="Only admins can create users")
-    
-    if user.password != user.confirm_password:
-        raise HTTPException(status_code=400, detail="Passwords do not match")
-
-    hashed_password = hash_password(user.password)
-    new_user = User(username=user.username, email=user.email, password=hashed_password, department=user.department, role=user.role)
-    
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
-    return new_user
+async def register(request: Request, user: UserCreate, db: DbSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    # ✅ Audited on every outcome; recording only enqueues, the row is written in a later batch
+    async with audit_log.track("user.create", current_user.username, ip=client_host(request)) as event:
+        if current_user.role != RoleEnum.Admin:
+            raise HTTPException(status_code=403, detail="Only admins can create users")
 
-# ** login with tocken jwt **
-@app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password):
-        raise HTTPException(status_code=400, detail="Invalid username or password")
+        if user.password != user.confirm_password:
+            raise HTTPException(status_code=400, detail="Passwords do not match")
 
-    # Update last login and set user as online
-    user.last_login = datetime.utcnow()
-    user.is_online = True
-    db.commit()
+        hashed_password = await hash_password_async(user.password)
+        # ✅ INSERT ... RETURNING where supported: no separate refresh query
+        new_user = await crud.create_user(db, {
+            "username": user.username, "email": user.email, "password": hashed_password,
+            "department": user.department, "role": user.role,
+        })
+        event["target_id"] = new_user.id
+    search_index.add(new_user)
+    response = user_response(new_user)
+    replica_router.note_write(current_user.username, response)  # ✅ Their next reads go to the primary, on any worker
+    return response
+
+async def audit_created(result: BulkRegisterResponse, current_user: Principal, request: Request):
+    # one user.create event per new user, like /register, so the trail can be queried by target
+    for item in result.results:
+        if item.status == "created":
+            await audit_log.record("user.create", current_user.username, item.id, client_host(request), detail="bulk")
+
+# ** just Admin can provision many users at once (JSON array) **
+@app.post("/register/bulk", response_model=BulkRegisterResponse)
+async def register_bulk(
+    request: Request,
+    response: Response,
+    users: List[Dict[str, Any]] = Body(...),
+    db: DbSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    async with audit_log.track("user.bulk_create", current_user.username, ip=client_host(request)) as event:
+        if current_user.role != RoleEnum.Admin:
+            raise HTTPException(status_code=403, detail="Only admins can create users")
+        result = await provision_users(db, users)
+        event["detail"] = f"{result.created} created, {result.failed} failed"
+    await audit_created(result, current_user, request)
+    replica_router.note_write(current_user.username, response)
+    return result
+
+# ** just Admin can provision many users at once (CSV upload) **
+@app.post("/register/bulk/csv", response_model=BulkRegisterResponse)
+async def register_bulk_csv(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    db: DbSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    async with audit_log.track("user.bulk_create", current_user.username, ip=client_host(request)) as event:
+        if current_user.role != RoleEnum.Admin:
+            raise HTTPException(status_code=403, detail="Only admins can create users")
+        result = await provision_users(db, parse_csv(await file.read()))
+        event["detail"] = f"{result.created} created, {result.failed} failed"
+    await audit_created(result, current_user, request)
+    replica_router.note_write(current_user.username, response)
+    return result
+
+# users whose hash is being upgraded, so a burst of logins rehashes once
+rehashing = set()
+
+async def rehash_password(user_id: int, old_hash: str, password: str):
+    if user_id in rehashing:
+        return
+    rehashing.add(user_id)
+    try:
+        new_hash = await hash_password_async(password)
+        async with async_session_scope() as db:
+            await crud.replace_password_hash(db, user_id, old_hash, new_hash)
+    except HTTPException:
+        pass  # hashing pool is saturated: the next login tries again
+    finally:
+        rehashing.discard(user_id)
 
-    access_token = create_access_token(data={"sub": user.username})
+# ** login with tocken jwt **
+@app.post("/login")
+async def login(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: DbSession = Depends(get_async_db)
+):
+    client_ip = client_host(request)
+    # ✅ Every attempt is audited, throttled and failed ones included
+    async with audit_log.track("login", form_data.username, ip=client_ip) as event:
+        # ✅ Throttled attempts get a cheap 429 and never reach bcrypt
+        cost = await login_throttle.acquire(form_data.username, client_ip)
+
+        user = await crud.get_credentials(db, form_data.username)
+        if not user or not await verify_password_async(form_data.password, user.password):
+            await login_throttle.failed(client_ip, cost)  # ✅ Only failures count against a shared address
+            raise HTTPException(status_code=400, detail="Invalid username or password")
+        event["target_id"] = user.id
+    await login_throttle.succeeded(form_data.username, client_ip, cost)
+
+    # ✅ Hashes with an old scheme or cost are upgraded after the response is sent
+    if needs_rehash(user.password):
+        background_tasks.add_task(rehash_password, user.id, user.password, form_data.password)
+
+    # Update last login and set user as online (written back in batches) until the token expires
+    now = datetime.utcnow()
+    expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    presence.mark_online(user.id, user.username, now, expires_at=now + expires_delta)
+
+    access_token = create_access_token(data={"sub": user.username}, expires_delta=expires_delta)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # ** just Admin can add get all users **
 @app.get("/users", response_model=List[UserResponse])
-def get_all_users(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_all_users(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = Query(None, description="id of the last user on the previous page"),
+    role: Optional[RoleEnum] = None,
+    department: Optional[str] = None,
+    is_online: Optional[bool] = None,
+    order: Literal["asc", "desc"] = "asc",
+    if_none_match: Optional[str] = Header(None),
+    db: DbSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
     if current_user.role != RoleEnum.Admin:
         raise HTTPException(status_code=403, detail="Only admins can view users")
-    return db.query(User).all()
+
+    # ✅ Index-only version check first: an unchanged listing is a 304 without reading rows
+    etag = collection_etag(await crud.collection_version(db), sorted(request.query_params.multi_items()))
+    if matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # ✅ Same version and query: the page is served already serialized and compressed
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    cached = listing_cache.get((etag, encoding))
+    if cached is None:
+        # ✅ Keyset pagination on id: every page is an index range scan, however deep
+        rows = await crud.list_users(db, limit, cursor, order, role=role, department=department, is_online=is_online)
+        page_headers = {}
+        if len(rows) > limit:
+            rows = rows[:limit]
+            page_headers["X-Next-Cursor"] = str(rows[-1].id)
+        # ✅ Rows are encoded as fetched, without re-validating them through UserResponse
+        body, content_encoding = await compress(dump_users(rows), encoding)
+        cached = (body, content_encoding, page_headers)
+        listing_cache.set((etag, encoding), cached)
+    body, content_encoding, page_headers = cached
+    return encoded_response(body, content_encoding, {**etag_headers(etag), **page_headers})
+
+# ** just Admin can export the user directory (streamed, constant memory) **
+@app.get("/users/export")
+async def export_users(
+    request: Request,
+    fmt: Literal["ndjson", "csv"] = Query("ndjson", alias="format"),
+    role: Optional[RoleEnum] = None,
+    department: Optional[str] = None,
+    is_online: Optional[bool] = None,
+    current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role != RoleEnum.Admin:
+        raise HTTPException(status_code=403, detail="Only admins can export users")
+
+    query = crud.export_query(role=role, department=department, is_online=is_online)
+    columns = [column.key for column in crud.USER_RESPONSE_COLUMNS]
+    wrote_at = request.cookies.get(READ_YOUR_WRITES_COOKIE)
+
+    async def generate():
+        # own session: the stream outlives the request dependencies
+        yield encode_header(fmt, columns)
+        async with read_session_scope(current_user.username, wrote_at) as db:
+            result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for rows in result.partitions(EXPORT_BATCH_SIZE):
+                yield encode_rows(fmt, columns, rows)
+
+    return StreamingResponse(
+        generate(),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="users.{fmt}"'},
+    )
+
+async def conditional_user_response(db, if_none_match: Optional[str], load, **key):
+    """Single-user GET honouring If-None-Match: a 304 costs an (id, updated_at) lookup only."""
+    if if_none_match:
+        version = await crud.get_user_version(db, **key)
+        if version and matches(if_none_match, user_etag(*version)):
+            return not_modified(user_etag(*version))
+    user = await load(db, *key.values())
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_response(user, etag_headers(user_etag(user.id, user.updated_at)))
+
+# ** just Admin can search users by username/email/department prefix (typeahead) **
+@app.get("/users/search", response_model=List[UserSearchResult])
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    fields: List[Literal["username", "email", "department"]] = Query(list(SEARCH_FIELDS)),
+    db: DbSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    if current_user.role != RoleEnum.Admin:
+        raise HTTPException(status_code=403, detail="Only admins can search for users")
+
+    # ✅ Answered from the in-memory prefix index; LIKE 'q%' queries only until it is loaded
+    if search_index.ready:
+        results = search_index.search(q, limit, fields)
+    else:
+        results = await search_database(db, q, limit, fields)
+    return Response(dumps(results), media_type="application/json")
 
 # ** just Admin can add find user by email **
 @app.get("/user/email/{email}", response_model=UserResponse)
-def get_user_by_email(email: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_user_by_email(
+    email: str,
+    if_none_match: Optional[str] = Header(None),
+    db: DbSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
     if current_user.role != RoleEnum.Admin:
         raise HTTPException(status_code=403, detail="Only admins can search for users")
-
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return await conditional_user_response(db, if_none_match, crud.get_user_by_email, email=email)
 
 # ** just Admin can find user by username **
 @app.get("/user/username/{username}", response_model=UserResponse)
-def get_user_by_username(username: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_user_by_username(
+    username: str,
+    if_none_match: Optional[str] = Header(None),
+    db: DbSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
     if current_user.role != RoleEnum.Admin:
         raise HTTPException(status_code=403, detail="Only admins can search for users")
-
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    return await conditional_user_response(db, if_none_match, crud.get_user_by_username, username=username)
 
 # ** just Admin can update info of user **
 @app.put("/user/update/{user_id}", response_model=UserResponse)
-def update_user(
+async def update_user(
+    request: Request,
     user_id: int, 
     updated_user: UserUpdate,  # ✅ Use `UserUpdate` schema for optional updates
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    db: DbSession = Depends(get_async_db), 
+    current_user: Principal = Depends(get_current_user)
 ):
-    if current_user.role != RoleEnum.Admin:
-        raise HTTPException(status_code=403, detail="Only admins can update users")
-
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # ✅ Ensure passwords match (if updating password)
-    if updated_user.password and updated_user.confirm_password:
-        if updated_user.password != updated_user.confirm_password:
-            raise HTTPException(status_code=400, detail="Passwords do not match")
-        user.password = hash_password(updated_user.password)  # ✅ Hash new password
-
-    # ✅ Update only provided fields
-    if updated_user.username:
-        user.username = updated_user.username
-    if updated_user.email:
-        user.email = updated_user.email
-    if updated_user.department:
-        user.department = updated_user.department
-    if updated_user.role:
-        user.role = updated_user.role
-
-    db.commit()
-    db.refresh(user)
-    return user
+    async with audit_log.track("user.update", current_user.username, user_id, client_host(request)) as event:
+        if current_user.role != RoleEnum.Admin:
+            raise HTTPException(status_code=403, detail="Only admins can update users")
+
+        values = {}
+        # ✅ Ensure passwords match (if updating password)
+        if updated_user.password and updated_user.confirm_password:
+            if updated_user.password != updated_user.confirm_password:
+                raise HTTPException(status_code=400, detail="Passwords do not match")
+            values["password"] = await hash_password_async(updated_user.password)  # ✅ Hash new password
+
+        # ✅ Update only provided fields
+        for field in ("username", "email", "department", "role"):
+            value = getattr(updated_user, field)
+            if value:
+                values[field] = value
+
+        # ✅ One UPDATE keyed by id (RETURNING where supported), no SELECT before it
+        user = await crud.update_user(db, user_id, values)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        event["detail"] = "changed: " + ", ".join(sorted(values))  # field names only, never values
+    search_index.add(user)
+    if "username" in values:
+        presence.rename(user_id, user.username)
+    invalidate_principal(user_id=user_id)
+    response = user_response(user)
+    replica_router.note_write(current_user.username, response)
+    return response
 
 # ** just Admin can delete user **
 @app.delete("/user/delete/{user_id}")
-def delete_user(
+async def delete_user(
+    request: Request,
+    response: Response,
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Security(get_current_user, scopes=["admin"])
+    db: DbSession = Depends(get_async_db),
+    current_user: Principal = Security(get_current_user, scopes=["admin"])
 ):
     """Only Admin can delete users"""
-    if current_user.role != RoleEnum.Admin:  #  Ensure only Admins can delete
-        raise HTTPException(status_code=403, detail="Only admins can delete users")
+    async with audit_log.track("user.delete", current_user.username, user_id, client_host(request)):
+        if current_user.role != RoleEnum.Admin:  #  Ensure only Admins can delete
+            raise HTTPException(status_code=403, detail="Only admins can delete users")
+
+        # ✅ One DELETE keyed by id, its rowcount tells whether the user existed
+        if not await crud.delete_user(db, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+    replica_router.note_write(current_user.username, response)
+    search_index.remove(user_id)
+    invalidate_principal(user_id=user_id)
+    presence.forget(user_id)
+    return {"message": "User deleted successfully"}
 
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+def service_gauges():
+    pool = pool_stats(request_engine().pool)
+    gauges = {
+        "principal_cache_hits_total": principal_cache.hits,
+        "principal_cache_misses_total": principal_cache.misses,
+        "principal_cache_size": len(principal_cache),
+        "token_cache_hits_total": token_cache.hits,
+        "token_cache_misses_total": token_cache.misses,
+        "token_cache_size": len(token_cache),
+        "password_hash_pending": password_hasher.pending,
+        "password_hash_rejected_total": password_hasher.rejected,
+        "presence_pending_writes": presence.pending(),
+        "presence_tracked_sessions": presence.sessions(),
+        "login_throttle_rejected_total": login_throttle.rejected,
+        "db_replica_reads_total": replica_router.replica_reads,
+        "db_primary_reads_total": replica_router.primary_reads,
+        "search_index_users": len(search_index),
+        "listing_cache_hits_total": listing_cache.hits,
+        "listing_cache_misses_total": listing_cache.misses,
+        "listing_cache_size": len(listing_cache),
+        "audit_queued_events": audit_log.pending(),
+        "audit_written_total": audit_log.written,
+        "audit_dropped_total": audit_log.dropped,
+        "audit_write_errors_total": audit_log.write_errors,
+    }
+    for key in ("checked_out", "overflow", "checkout_wait_seconds", "checkout_timeouts"):
+        if key in pool:
+            gauges[f"db_pool_{key}"] = pool[key]
+    return gauges
 
-    db.delete(user)
-    db.commit()
-    return {"message": "User deleted successfully"}
+gauge_sources.append(service_gauges)
+
+# ** Prometheus metrics (route latency, DB queries, bcrypt and JWT time) **
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# ** just Admin can view live connection pool statistics **
+@app.get("/admin/pool")
+async def get_pool_stats(current_user: Principal = Depends(get_current_user)):
+    if current_user.role != RoleEnum.Admin:
+        raise HTTPException(status_code=403, detail="Only admins can view pool statistics")
+    return pool_stats(request_engine().pool)
 
 @app.get("/user/status/{username}")
-def get_user_status(username: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == username).first()
+async def get_user_status(username: str, db: DbSession = Depends(get_read_db)):
+    state = presence.get(username)
+    if state is not None:
+        return {"username": username, "is_online": state.is_online, "last_login": state.last_login}
+
+    user = await crud.get_status(db, username)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -192,14 +456,44 @@ def get_user_status(username: str, db: Session = Depends(get_db)):
         "is_online": user.is_online,
         "last_login": user.last_login
     }
-@app.post("/logout")
-def logout(current_user: User = Security(get_current_user, scopes=["user"]), db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == current_user.username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
 
-    user.is_online = False
-    db.commit()
+# ** status of many users in one request (ward dashboards) **
+@app.post("/users/status", response_model=Dict[str, UserStatus])
+async def get_users_status(
+    request: StatusBatchRequest,
+    db: DbSession = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user)
+):
+    if not request.usernames and not request.department:
+        raise HTTPException(status_code=400, detail="Provide usernames or a department")
+    # ✅ A department lookup lists its members: admins may ask about any, others only their own
+    if request.department and current_user.role != RoleEnum.Admin and request.department != current_user.department:
+        raise HTTPException(status_code=403, detail="Only admins can view other departments")
+
+    statuses = {}
+    missing = set(request.usernames or [])
+    if not request.department:
+        # ✅ Answer what this worker already knows, query only the rest
+        for username in list(missing):
+            state = presence.get(username)
+            if state is not None:
+                statuses[username] = {"is_online": state.is_online, "last_login": state.last_login}
+                missing.discard(username)
+        if not missing:
+            return statuses
+
+    for row in await crud.get_statuses(db, missing, request.department):
+        state = presence.get(row.username)
+        if state is not None:
+            statuses[row.username] = {"is_online": state.is_online, "last_login": state.last_login}
+        else:
+            statuses[row.username] = {"is_online": row.is_online, "last_login": row.last_login}
+    return statuses
+
+@app.post("/logout")
+async def logout(current_user: Principal = Security(get_current_user, scopes=["user"])):
+    presence.mark_offline(current_user.id, current_user.username)
+    invalidate_principal(username=current_user.username)
 
-    return {"message": f"User {user.username} logged out successfully"}
+    return {"message": f"User {current_user.username} logged out successfully"}
 
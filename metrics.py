@@ -0,0 +1,209 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+# seconds; covers fast cache hits up to slow bcrypt-bound requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram with fixed buckets."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+
+class Family:
+    """A metric name with one child per label set."""
+
+    def __init__(self, name: str, help_text: str, kind: str, labels: Tuple[str, ...], factory: Callable):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labels = labels
+        self._factory = factory
+        self._children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def child(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def items(self):
+        return list(self._children.items())
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class RequestTimings:
+    """Per-request accumulator behind the Server-Timing header."""
+    __slots__ = ("db_count", "db_time", "hash_time", "jwt_time")
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_time = 0.0
+        self.hash_time = 0.0
+        self.jwt_time = 0.0
+
+
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("current_timings", default=None)
+
+http_requests = Family("http_requests_total", "HTTP requests by route and status.", "counter",
+                       ("method", "route", "status"), Counter)
+http_latency = Family("http_request_duration_seconds", "HTTP request latency by route.", "histogram",
+                      ("method", "route"), Histogram)
+db_queries = Family("db_query_duration_seconds", "Database statement execution time.", "histogram", (), Histogram)
+password_hashing = Family("password_hash_duration_seconds", "Password hash/verify time seen by the request.",
+                          "histogram", ("operation",), Histogram)
+jwt_decoding = Family("jwt_decode_duration_seconds", "decode_token time, cache hits included.", "histogram",
+                      (), Histogram)
+
+FAMILIES = [http_requests, http_latency, db_queries, password_hashing, jwt_decoding]
+
+# callables returning {name: value} read at scrape time (caches, pools, queues); *_total are counters
+gauge_sources: List[Callable[[], Dict[str, float]]] = []
+
+
+@contextmanager
+def track(kind: str, operation: str = ""):
+    """Time a block as password hashing ("hash") or JWT decoding ("jwt")."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings = current_timings.get()
+        if kind == "hash":
+            password_hashing.child(operation).observe(elapsed)
+            if timings is not None:
+                timings.hash_time += elapsed
+        else:
+            jwt_decoding.child().observe(elapsed)
+            if timings is not None:
+                timings.jwt_time += elapsed
+
+
+def instrument_engine(engine):
+    """Count statements and time spent in the database, per request and overall."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.child().observe(elapsed)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.db_count += 1
+            timings.db_time += elapsed
+
+
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: route latency histograms plus a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total = (time.perf_counter() - start) * 1000
+                server_timing = (
+                    f'app;dur={total:.2f}, db;dur={timings.db_time * 1000:.2f};desc="{timings.db_count} queries", '
+                    f"hash;dur={timings.hash_time * 1000:.2f}, jwt;dur={timings.jwt_time * 1000:.2f}"
+                )
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", server_timing.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = _route_name(scope)
+            http_latency.child(scope["method"], route).observe(elapsed)
+            http_requests.child(scope["method"], route, str(status)).inc()
+            current_timings.reset(token)
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus() -> str:
+    lines = []
+    for family in FAMILIES:
+        lines.append(f"# HELP {family.name} {family.help_text}")
+        lines.append(f"# TYPE {family.name} {family.kind}")
+        for values, child in family.items():
+            if isinstance(child, Histogram):
+                counts, total, count = child.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(child.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{family.name}_bucket{_labels(family.labels, values, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{family.name}_bucket{_labels(family.labels, values, le)} {count}")
+                lines.append(f"{family.name}_sum{_labels(family.labels, values)} {total}")
+                lines.append(f"{family.name}_count{_labels(family.labels, values)} {count}")
+            else:
+                lines.append(f"{family.name}{_labels(family.labels, values)} {child.value}")
+    for source in gauge_sources:
+        for name, value in source().items():
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,88 @@
+"""Bring an existing database up to the models: missing tables, columns and indexes.
+
+    python migrate.py            # apply
+    python migrate.py --dry-run  # print the statements only
+
+Columns are added as nullable and back-filled from their Python default
+(e.g. updated_at), so the statements are safe on a populated table. On MySQL,
+indexes are built online (ALGORITHM=INPLACE, LOCK=NONE): reads and writes
+continue during the build, and the statement fails rather than lock the table.
+Also run at startup when AUTO_CREATE_SCHEMA is on.
+"""
+import argparse
+import sys
+from typing import List
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from database import Base, get_engine
+import models  # noqa: F401  (registers the tables on Base.metadata)
+
+
+def _backfill_value(column):
+    default = column.default
+    if default is None or not (default.is_scalar or default.is_callable):
+        return None
+    return default.arg(None) if default.is_callable else default.arg
+
+
+def _create_index(index, dialect) -> str:
+    statement = str(CreateIndex(index).compile(dialect=dialect))
+    if dialect.name in ("mysql", "mariadb"):
+        statement += " ALGORITHM=INPLACE LOCK=NONE"
+    return statement
+
+
+def plan(engine) -> List[tuple]:
+    """(statement, parameters) needed to add missing columns, then missing indexes, in order."""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    steps = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # created whole by create_all
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            spec = str(CreateColumn(column).compile(dialect=engine.dialect)).replace(" NOT NULL", "")
+            steps.append((f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {spec}", None))
+            value = _backfill_value(column)
+            if value is not None:
+                name = preparer.format_column(column)
+                steps.append((f"UPDATE {preparer.format_table(table)} SET {name} = :value WHERE {name} IS NULL",
+                              {"value": value}))
+        # by name: unique constraints show up as indexes on some backends but are not in table.indexes
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in existing_indexes:
+                steps.append((_create_index(index, engine.dialect), None))
+    return steps
+
+
+def migrate(engine=None, dry_run: bool = False) -> List[str]:
+    """Create missing tables, then add missing columns and indexes; returns the statements run."""
+    engine = engine or get_engine()
+    steps = plan(engine)
+    if not dry_run:
+        Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            for statement, parameters in steps:
+                conn.execute(text(statement), parameters or {})
+    return [statement for statement, _ in steps]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+    statements = migrate(dry_run=args.dry_run)
+    for statement in statements:
+        print(f"{statement};")
+    if not statements:
+        print("schema is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
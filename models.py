@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, Enum
+from sqlalchemy import Boolean, Column, DateTime, Index, Integer, String, Enum
+from sqlalchemy.dialects import mysql
 from database import Base
 import enum
 
@@ -8,6 +9,9 @@ class RoleEnum(str, enum.Enum):
     Doctor = "Doctor"
     Employee = "Employee"
 
+# DATETIME(6) on MySQL: sub-second precision for row versions and audit timestamps
+PreciseDateTime = DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -19,3 +23,29 @@ class User(Base):
     role = Column(Enum(RoleEnum), default=RoleEnum.Employee, nullable=False)
     last_login = Column(DateTime, default=datetime.utcnow)  # Track last login time
     is_online = Column(Boolean, default=False)  # Track online status
+    # row version behind the ETags
+    updated_at = Column(PreciseDateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # set by admin writes only (presence write-backs leave it alone); versions the search index
+    profile_updated_at = Column(PreciseDateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        # /users filters (role, department, is_online in any combination) and the startup admin check;
+        # SQLite and InnoDB both append the primary key, so `ORDER BY id` pages stay on the index
+        Index("ix_users_role_department_is_online", "role", "department", "is_online"),
+        # department dashboards and /users/status?department=, optionally online only
+        Index("ix_users_department_is_online", "department", "is_online"),
+        # the session sweeper: online users whose last login is older than a token lifetime
+        Index("ix_users_is_online_last_login", "is_online", "last_login"),
+    )
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True)
+    at = Column(PreciseDateTime, nullable=False)
+    action = Column(String(32), nullable=False)       # login, user.create, user.update, user.delete, ...
+    actor = Column(String(50))                         # username making the request (or attempting to log in)
+    target_id = Column(Integer)                        # user acted upon
+    ip = Column(String(45))
+    success = Column(Boolean, nullable=False)
+    detail = Column(String(255))
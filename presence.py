@@ -0,0 +1,215 @@
+import asyncio
+import heapq
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, update
+from database import async_session_scope
+from models import User
+import crud
+
+load_dotenv()
+
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "5"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Presence:
+    user_id: int
+    is_online: bool
+    last_login: Optional[datetime]
+
+
+class PresenceStore:
+    """In-memory is_online / last_login state, written back to `users` in batches.
+
+    Login and logout only touch memory; `flush()` coalesces every change since
+    the previous flush into one executemany UPDATE keyed by primary key.
+    Each worker holds the presence it has seen; usernames it has not seen are
+    answered from the database.
+
+    Logins also record when their token expires; `sweep()` turns sessions past
+    that point offline, so the auth path itself never writes. That write only
+    applies while the row still holds the login that expired: a user who has
+    logged in again on another worker since stays online.
+    """
+
+    def __init__(self):
+        self._by_username: Dict[str, Presence] = {}
+        self._username_by_id: Dict[int, str] = {}
+        self._dirty: Dict[int, dict] = {}
+        self._expires_at: Dict[int, datetime] = {}
+        self._expiry_heap: List[Tuple[datetime, int]] = []
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_loop = None
+
+    def mark_online(self, user_id: int, username: str, at: Optional[datetime] = None,
+                    expires_at: Optional[datetime] = None):
+        """Record a login; `expires_at` (the token expiry) schedules the session for the sweeper."""
+        at = at or datetime.utcnow()
+        with self._lock:
+            self._by_username[username] = Presence(user_id, True, at)
+            self._username_by_id[user_id] = username
+            self._dirty[user_id] = {"id": user_id, "is_online": True, "last_login": at}
+            current = self._expires_at.get(user_id)
+            if expires_at is not None and (current is None or expires_at > current):
+                # the latest token wins; older heap entries are skipped when popped
+                self._expires_at[user_id] = expires_at
+                heapq.heappush(self._expiry_heap, (expires_at, user_id))
+
+    def mark_offline(self, user_id: int, username: str):
+        with self._lock:
+            current = self._by_username.get(username)
+            if current is not None:
+                self._by_username[username] = Presence(user_id, False, current.last_login)
+            # else a login this worker never saw: only the write-back is queued, and reads keep
+            # going to the database, which has the real last_login
+            change = self._dirty.setdefault(user_id, {"id": user_id})
+            change["is_online"] = False
+            change.pop("expired_login", None)  # a logout applies whatever session the row holds
+
+    def get(self, username: str) -> Optional[Presence]:
+        return self._by_username.get(username)
+
+    def forget(self, user_id: int):
+        """Drop the cached entry (e.g. on delete); pending writes are kept."""
+        with self._lock:
+            username = self._username_by_id.pop(user_id, None)
+            if username is not None:
+                self._by_username.pop(username, None)
+            self._expires_at.pop(user_id, None)
+
+    def rename(self, user_id: int, new_username: str):
+        """Keyed by id, so callers need not load the old username first."""
+        with self._lock:
+            old_username = self._username_by_id.get(user_id)
+            if old_username is None or old_username == new_username:
+                return
+            self._by_username[new_username] = self._by_username.pop(old_username)
+            self._username_by_id[user_id] = new_username
+
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    def sessions(self) -> int:
+        return len(self._expires_at)
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """Mark sessions whose token has expired offline (in memory); returns how many."""
+        now = now or datetime.utcnow()
+        expired = 0
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, user_id = heapq.heappop(self._expiry_heap)
+                if self._expires_at.get(user_id) != expires_at:
+                    continue  # superseded by a later login, or forgotten
+                del self._expires_at[user_id]
+                username = self._username_by_id.get(user_id)
+                state = self._by_username.get(username)
+                if state is None or not state.is_online:
+                    continue  # already logged out
+                self._by_username[username] = Presence(user_id, False, state.last_login)
+                change = self._dirty.setdefault(user_id, {"id": user_id})
+                change["is_online"] = False
+                change["expired_login"] = state.last_login  # written as a condition, not a column
+                expired += 1
+        return expired
+
+    def _drain(self) -> Dict[int, dict]:
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        return dirty
+
+    def _restore(self, changes: Dict[int, dict]):
+        with self._lock:
+            for user_id, change in changes.items():
+                newer = self._dirty.get(user_id, {})
+                merged = {**change, **newer}
+                if newer and "expired_login" not in newer:
+                    merged.pop("expired_login", None)  # the newer change is not conditional
+                self._dirty[user_id] = merged
+
+    def _flush_guard(self) -> asyncio.Lock:
+        # one lock per event loop (the app's, or a script's asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self._flush_loop is not loop:
+            self._flush_lock, self._flush_loop = asyncio.Lock(), loop
+        return self._flush_lock
+
+    async def flush(self) -> int:
+        """Write back every change since the last flush.
+
+        run() and the sweeper both flush; the lock keeps write-backs in order, so
+        an older is_online=True can never commit after a newer offline change.
+        """
+        async with self._flush_guard():
+            return await self._flush()
+
+    async def _flush(self) -> int:
+        changes = self._drain()
+        if not changes:
+            return 0
+        try:
+            async with async_session_scope() as db:
+                # group by changed columns (and expiry condition) so each group is a single executemany
+                groups: Dict[tuple, list] = {}
+                for change in changes.values():
+                    columns = tuple(sorted(key for key in change if key not in ("id", "expired_login")))
+                    group = (columns, "expired_login" in change)
+                    groups.setdefault(group, []).append({f"b_{key}": value for key, value in change.items()})
+                for (columns, expiry), rows in groups.items():
+                    statement = (
+                        update(User)
+                        .where(User.id == bindparam("b_id"))
+                        .values({column: bindparam(f"b_{column}") for column in columns})
+                    )
+                    if expiry:
+                        # ✅ A later login (e.g. on another worker) moved last_login on: that session stays online
+                        statement = statement.where(User.last_login <= bindparam("b_expired_login"))
+                    # core executemany: users deleted since their login simply match no row
+                    await db.execute(statement, rows, execution_options={"dml_strategy": "core_only"})
+                await db.commit()
+        except BaseException:
+            # cancellation at shutdown included: the changes go back for the final flush
+            self._restore(changes)
+            raise
+        return len(changes)
+
+    async def run(self, interval: float = PRESENCE_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Presence flush failed, will retry")
+
+    async def sweep(self, session_lifetime: timedelta, now: Optional[datetime] = None) -> int:
+        """Expire this worker's sessions, then catch the ones it never saw in the database.
+
+        Sessions issued by other workers, or before a restart, are offline once
+        their last login is older than a token lifetime: one UPDATE covers them.
+        """
+        now = now or datetime.utcnow()
+        expired = self.expire(now)
+        await self.flush()  # write recent logins first so they are not briefly reported offline
+        async with async_session_scope() as db:
+            return expired + await crud.expire_sessions(db, now - session_lifetime)
+
+    async def run_sweeper(self, session_lifetime: timedelta, interval: float = SESSION_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep(session_lifetime)
+            except Exception:
+                logger.exception("Session sweep failed, will retry")
+
+
+presence = PresenceStore()
@@ -0,0 +1,37 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+from dotenv import load_dotenv
+from cache import TTLCache
+from models import RoleEnum
+
+load_dotenv()
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "1024"))
+# the cache is per worker: a role change or deletion reaches the other workers only when this runs out
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "5"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Immutable snapshot of the authenticated user, safe to share between requests."""
+    id: int
+    username: str
+    role: RoleEnum
+    department: str
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, username=user.username, role=user.role, department=user.department)
+
+
+# keyed by token subject (the username)
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+
+def invalidate_principal(username: Optional[str] = None, user_id: Optional[int] = None):
+    """Forget a cached principal so role changes, renames and deletions apply at once on this worker."""
+    if username is not None:
+        principal_cache.pop(username)
+    if user_id is not None:
+        principal_cache.discard_where(lambda principal: principal.id == user_id)
@@ -0,0 +1,97 @@
+import csv
+import io
+import os
+from typing import Any, Dict, List
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from auth import hash_passwords_async
+import crud
+from search import search_index
+from schemas import BulkRegisterResponse, BulkUserResult, UserCreate
+
+BULK_REGISTER_MAX_ROWS = int(os.getenv("BULK_REGISTER_MAX_ROWS", "5000"))
+
+
+def parse_csv(content: bytes) -> List[Dict[str, Any]]:
+    """Rows of an uploaded CSV with a header line matching the UserCreate fields."""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV file must be UTF-8 encoded")
+    return [{key: value for key, value in row.items() if key} for row in csv.DictReader(io.StringIO(text))]
+
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+async def provision_users(db, records: List[Dict[str, Any]]) -> BulkRegisterResponse:
+    """Validate, hash and insert a batch of users in one transaction, reporting per row."""
+    if len(records) > BULK_REGISTER_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_REGISTER_MAX_ROWS} users per request")
+
+    results: List[BulkUserResult] = []
+    valid: List[tuple] = []  # (result, UserCreate)
+    usernames, emails = set(), set()
+
+    # ✅ Validate everything up front, before any hashing or SQL
+    for index, record in enumerate(records):
+        username = record.get("username") if isinstance(record, dict) else None
+        result = BulkUserResult(index=index, username=username, status="invalid")
+        results.append(result)
+        try:
+            user = UserCreate(**record)
+        except ValidationError as e:
+            result.detail = _describe(e)
+            continue
+        except HTTPException as e:
+            result.detail = e.detail
+            continue
+        except TypeError:
+            result.detail = "Each user must be an object"
+            continue
+        if user.password != user.confirm_password:
+            result.detail = "Passwords do not match"
+            continue
+        if user.username in usernames or user.email in emails:
+            result.status, result.detail = "conflict", "Duplicate username or email in this request"
+            continue
+        usernames.add(user.username)
+        emails.add(user.email)
+        valid.append((result, user))
+
+    # ✅ One query for conflicts with existing accounts
+    if valid:
+        existing = await crud.find_taken(db, usernames, emails)
+        taken_usernames = {row.username for row in existing}
+        taken_emails = {row.email for row in existing}
+        remaining = []
+        for result, user in valid:
+            if user.username in taken_usernames:
+                result.status, result.detail = "conflict", "Username already exists"
+            elif user.email in taken_emails:
+                result.status, result.detail = "conflict", "Email already exists"
+            else:
+                remaining.append((result, user))
+        valid = remaining
+
+    if valid:
+        hashed = await hash_passwords_async([user.password for _, user in valid])
+        rows = [
+            {"username": user.username, "email": user.email, "password": password,
+             "department": user.department, "role": user.role}
+            for (_, user), password in zip(valid, hashed)
+        ]
+        try:
+            ids = await crud.insert_users(db, rows)  # multi-row INSERTs, one transaction
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Some users were created concurrently, please retry")
+        for result, user in valid:
+            result.status, result.id = "created", ids.get(user.username)
+            if result.id is not None:
+                search_index.add((result.id, user.username, user.email, user.department, user.role))
+
+    created = sum(1 for result in results if result.status == "created")
+    return BulkRegisterResponse(created=created, failed=len(results) - created, results=results)
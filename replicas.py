@@ -0,0 +1,141 @@
+"""Read routing: GET handlers read from replicas, everything else from the primary.
+
+A principal who has just written reads from the primary for
+READ_YOUR_WRITES_SECONDS, so replication lag never hides their own change.
+The write response sets a cookie with the write time, so the next read finds
+it whichever worker or container serves it; clients that drop cookies still
+get the guarantee from the worker that took the write.
+With no DATABASE_REPLICA_URLS every read goes to the primary.
+"""
+import itertools
+import math
+import os
+import threading
+import time
+from typing import List, Optional
+from fastapi import Depends, HTTPException, Request, Response
+from fastapi.security import OAuth2PasswordBearer
+from dotenv import load_dotenv
+from auth import decode_token
+from cache import TTLCache
+from database import ASYNC_MODE, async_session_scope, pool_options, to_sync_url
+from metrics import instrument_engine
+
+load_dotenv()
+
+# comma separated, same driver family as DATABASE_URL (e.g. mysql+aiomysql in async mode)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_SELECTION = os.getenv("REPLICA_SELECTION", "round_robin")  # round_robin | least_busy
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))  # above the replication lag
+READ_YOUR_WRITES_MAX_KEYS = int(os.getenv("READ_YOUR_WRITES_MAX_KEYS", "10000"))
+READ_YOUR_WRITES_COOKIE = "last_write"  # unix time of the client's last write
+
+
+class ReplicaRouter:
+    """Picks the engine for a read and remembers who wrote recently."""
+
+    def __init__(self, urls: List[str] = DATABASE_REPLICA_URLS, selection: str = REPLICA_SELECTION,
+                 window: float = READ_YOUR_WRITES_SECONDS):
+        if selection not in ("round_robin", "least_busy"):
+            raise ValueError(f"Unknown replica selection: {selection}")
+        self.urls = list(urls)
+        self.selection = selection
+        self.window = window
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._engines = None
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._recent_writers = TTLCache(maxsize=READ_YOUR_WRITES_MAX_KEYS, ttl=window)
+
+    @property
+    def engines(self) -> list:
+        # built on first read, like the primary engine
+        if self._engines is None:
+            with self._lock:
+                if self._engines is None:
+                    self._engines = [self._create_engine(url) for url in self.urls]
+        return self._engines
+
+    @staticmethod
+    def _create_engine(url: str):
+        if ASYNC_MODE:
+            from sqlalchemy.ext.asyncio import create_async_engine
+            engine = create_async_engine(url, **pool_options(url))
+            instrument_engine(engine.sync_engine)
+            return engine
+        from sqlalchemy import create_engine
+        url = to_sync_url(url)
+        engine = create_engine(url, **pool_options(url))
+        instrument_engine(engine)
+        return engine
+
+    @staticmethod
+    def _busy(engine) -> int:
+        pool = engine.sync_engine.pool if ASYNC_MODE else engine.pool
+        return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+    def note_write(self, subject: Optional[str], response: Optional[Response] = None):
+        """Send `subject`'s reads to the primary for the window; `response` carries the mark to other workers."""
+        if subject is None or not self.urls:
+            return
+        self._recent_writers.set(subject, True)
+        if response is not None:
+            response.set_cookie(READ_YOUR_WRITES_COOKIE, f"{time.time():.3f}", max_age=math.ceil(self.window),
+                                httponly=True)
+
+    def wrote_recently(self, subject: Optional[str] = None, wrote_at: Optional[str] = None) -> bool:
+        if subject is not None and self._recent_writers.get(subject):
+            return True
+        try:
+            age = time.time() - float(wrote_at)
+        except (TypeError, ValueError):
+            return False
+        return -self.window < age < self.window  # tolerates clock skew between hosts either way
+
+    def choose(self, subject: Optional[str] = None, wrote_at: Optional[str] = None):
+        """Replica engine for this read, or None for the primary.
+
+        `wrote_at` is the client's write cookie, set by whichever worker took the write.
+        """
+        if not self.urls or self.wrote_recently(subject, wrote_at):
+            self.primary_reads += 1
+            return None
+        engines = self.engines
+        self.replica_reads += 1
+        if self.selection == "least_busy":
+            return min(engines, key=self._busy)
+        return engines[next(self._turn) % len(engines)]
+
+    async def dispose(self):
+        engines, self._engines = self._engines or [], None
+        for engine in engines:
+            if ASYNC_MODE:
+                await engine.dispose()
+            else:
+                engine.dispose()
+
+
+replica_router = ReplicaRouter()
+
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
+
+
+def token_subject(token: Optional[str] = Depends(optional_oauth2_scheme)) -> Optional[str]:
+    """Username behind the bearer token, if any; authentication itself is left to the handler."""
+    if not token:
+        return None
+    try:
+        return decode_token(token).get("sub")
+    except HTTPException:
+        return None
+
+
+def read_session_scope(subject: Optional[str] = None, wrote_at: Optional[str] = None):
+    return async_session_scope(replica_router.choose(subject, wrote_at))
+
+
+async def get_read_db(request: Request, subject: Optional[str] = Depends(token_subject)):
+    """Read-only session: a replica, or the primary right after this client wrote."""
+    async with read_session_scope(subject, request.cookies.get(READ_YOUR_WRITES_COOKIE)) as db:
+        yield db
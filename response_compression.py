@@ -0,0 +1,178 @@
+"""Response compression negotiated from Accept-Encoding, plus a cache of encoded listings.
+
+zstd and brotli are used when their packages are installed (pip install
+zstandard brotli), gzip always. Bodies under COMPRESSION_MIN_SIZE, streamed
+bodies (exports) and responses that already carry a Content-Encoding are
+sent as they are.
+
+Listings are cached already serialized and compressed, keyed on their ETag
+(collection version + query) and the negotiated encoding: a repeated poll
+costs the version query only, until the users table changes.
+"""
+import functools
+import gzip
+import os
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from cache import TTLCache
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+load_dotenv()
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # bytes
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+LISTING_CACHE_SIZE = int(os.getenv("LISTING_CACHE_SIZE", "256"))  # encoded pages kept per worker
+LISTING_CACHE_TTL = float(os.getenv("LISTING_CACHE_TTL", "300"))  # seconds; versions change on any write anyway
+
+# bodies this large are compressed in a worker thread rather than on the event loop
+THREAD_THRESHOLD = 64 * 1024
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def _zstd(body: bytes) -> bytes:
+    # a compressor per call: instances must not be shared between threads
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def _gzip(body: bytes) -> bytes:
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)  # mtime=0: same input, same bytes
+
+
+# server preference when the client rates several equally
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _zstd
+if brotli is not None:
+    COMPRESSORS["br"] = _brotli
+COMPRESSORS["gzip"] = _gzip
+
+
+@functools.lru_cache(maxsize=128)
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best available encoding for an Accept-Encoding header, or None for identity."""
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSORS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+async def _encode(body: bytes, encoding: str) -> bytes:
+    if len(body) >= THREAD_THRESHOLD:
+        return await run_in_threadpool(COMPRESSORS[encoding], body)
+    return COMPRESSORS[encoding](body)
+
+
+async def compress(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """(body, Content-Encoding) for `encoding`; small bodies stay uncompressed."""
+    if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+    return await _encode(body, encoding), encoding
+
+
+def _add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+def encoded_response(body: bytes, encoding: Optional[str], headers: Optional[dict] = None,
+                     media_type: str = "application/json") -> Response:
+    """Response for a body compressed (or not) by `compress`; the middleware leaves it alone."""
+    response = Response(body, media_type=media_type, headers=headers)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    _add_vary(response.headers)
+    return response
+
+
+# (etag, encoding) -> (body, Content-Encoding, extra headers)
+listing_cache = TTLCache(maxsize=LISTING_CACHE_SIZE, ttl=LISTING_CACHE_TTL)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing complete (non-streamed) responses."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or not compressible(headers.get("content-type")):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message  # held until the body shows whether it is worth compressing
+            elif message["type"] == "http.response.body":
+                headers = MutableHeaders(raw=list(start["headers"]))
+                _add_vary(headers)  # on identity responses too, so shared caches key on the header
+                body = message.get("body", b"")
+                passthrough = True
+                if encoding is None or message.get("more_body", False) or len(body) < self.minimum_size:
+                    await send({**start, "headers": headers.raw})
+                    await send(message)
+                    return
+                body = await _encode(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                await send({**start, "headers": headers.raw})
+                await send({"type": "http.response.body", "body": body})
+            else:
+                await send(message)
+
+        await self.app(scope, receive, send_compressed)
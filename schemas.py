@@ -1,5 +1,5 @@
 import datetime
-from typing import Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, EmailStr, Field
 from models import RoleEnum
 import re
@@ -62,3 +62,31 @@ class UserUpdate(BaseModel):
 
     class Config:
         from_attributes = True
+
+class BulkUserResult(BaseModel):
+    index: int
+    username: Optional[str] = None
+    status: Literal["created", "conflict", "invalid"]
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+class BulkRegisterResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkUserResult]
+
+class UserStatus(BaseModel):
+    is_online: Optional[bool]
+    last_login: Optional[datetime]
+
+class UserSearchResult(BaseModel):
+    id: int
+    username: str
+    email: str
+    department: str
+    role: RoleEnum
+    matched: Literal["username", "email", "department"]
+
+class StatusBatchRequest(BaseModel):
+    usernames: Optional[List[str]] = Field(None, max_length=1000)
+    department: Optional[str] = None
@@ -0,0 +1,215 @@
+"""In-memory prefix index behind the /users/search typeahead.
+
+One sorted list of (lowercased value, id) per searchable field; a prefix
+lookup is a bisect plus a short forward scan, so it costs O(log n + limit)
+however many users match. Built at startup and kept current by the write
+handlers of this worker. When crud.profile_version shows users added, deleted
+or edited elsewhere (other workers, bulk imports), only the rows whose
+profile_updated_at moved are read and applied one by one; the ids are compared
+only when the count shows a deletion. Logins do not change that version, so
+they never cause a refresh; manual SQL editing profiles should set
+profile_updated_at.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import threading
+from datetime import timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+import crud
+from replicas import read_session_scope
+
+load_dotenv()
+
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_INDEX_REFRESH_INTERVAL = float(os.getenv("SEARCH_INDEX_REFRESH_INTERVAL", "60"))  # 0 disables
+
+# searched in this order: a username match ranks above an email match, then department
+SEARCH_FIELDS = ("username", "email", "department")
+
+# rows this much older than the newest change seen are read again on refresh: a write
+# can commit after a later one, and workers' clocks differ (re-adding a row is harmless)
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+
+def search_result(row: Sequence, matched: str) -> dict:
+    user_id, username, email, department, role = row
+    return {"id": user_id, "username": username, "email": email, "department": department,
+            "role": role, "matched": matched}
+
+
+async def search_database(db, prefix: str, limit: int = 10, fields: Sequence[str] = SEARCH_FIELDS) -> List[dict]:
+    """Same ranking as the index, from `LIKE 'prefix%'` queries (one per field, until `limit`)."""
+    results, seen = [], set()
+    for field in SEARCH_FIELDS:
+        if field not in fields or len(results) >= limit:
+            continue
+        for row in await crud.users_with_prefix(db, field, prefix, limit - len(results), exclude=seen):
+            seen.add(row[0])
+            results.append(search_result(row, field))
+    return results
+
+
+class UserSearchIndex:
+    """Sorted per-field keys plus the rows they point to; `ready` once loaded."""
+
+    def __init__(self):
+        self.ready = False
+        self.version = None
+        self._keys: Dict[str, List[Tuple[str, int]]] = {field: [] for field in SEARCH_FIELDS}
+        self._users: Dict[int, tuple] = {}  # id -> crud.SEARCH_COLUMNS row
+        self._journal: Optional[List[tuple]] = None  # add/remove calls made while a rebuild or refresh reads
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @staticmethod
+    def _build(rows: Sequence[tuple]):
+        users = {row[0]: tuple(row) for row in rows}
+        keys = {
+            field: sorted((row[position].lower(), row[0]) for row in users.values())
+            for position, field in enumerate(SEARCH_FIELDS, start=1)
+        }
+        return users, keys
+
+    def _replay(self):
+        # writes made while the rows were read may be missing from them: apply them again
+        for operation, argument in self._journal or ():
+            if operation == "add":
+                self._add(argument)
+            else:
+                self._discard(argument)
+
+    def _swap(self, users, keys, version):
+        with self._lock:
+            self._users, self._keys = users, keys
+            self._replay()
+            self.version = version
+            self.ready = True
+
+    def _apply(self, rows: Sequence[tuple], ids: Optional[set], version):
+        """Add or replace `rows`; with `ids` (every id in the table), drop the users missing from it."""
+        with self._lock:
+            for row in rows:
+                self._add(tuple(row))
+            if ids is not None:
+                for user_id in self._users.keys() - ids:
+                    self._discard(user_id)
+            self._replay()
+            self.version = version
+
+    def load(self, rows: Sequence[tuple], version=None):
+        """Replace the whole index with `rows` (crud.SEARCH_COLUMNS order)."""
+        self._swap(*self._build(rows), version)
+
+    def add(self, row: Sequence):
+        """Insert or replace one user (id, username, email, department, role, ...)."""
+        row = tuple(row[:len(crud.SEARCH_COLUMNS)])
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("add", row))
+            if self.ready:  # else the first load reads it from the database
+                self._add(row)
+
+    def remove(self, user_id: int):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append(("remove", user_id))
+            self._discard(user_id)
+
+    def _add(self, row: tuple):
+        self._discard(row[0])
+        self._users[row[0]] = row
+        for position, field in enumerate(SEARCH_FIELDS, start=1):
+            bisect.insort(self._keys[field], (row[position].lower(), row[0]))
+
+    def _discard(self, user_id: int):
+        row = self._users.pop(user_id, None)
+        if row is None:
+            return
+        for position, field in enumerate(SEARCH_FIELDS, start=1):
+            keys = self._keys[field]
+            index = bisect.bisect_left(keys, (row[position].lower(), user_id))
+            if index < len(keys) and keys[index][1] == user_id:
+                del keys[index]
+
+    def search(self, prefix: str, limit: int = 10, fields: Sequence[str] = SEARCH_FIELDS) -> List[dict]:
+        """Users whose fields start with `prefix` (case-insensitive), best match first."""
+        prefix = prefix.lower()
+        results, seen = [], set()
+        with self._lock:
+            for field in SEARCH_FIELDS:
+                if field not in fields:
+                    continue
+                keys = self._keys[field]
+                index = bisect.bisect_left(keys, (prefix,))
+                # sorted order puts an exact match first, then completions alphabetically
+                while index < len(keys) and len(results) < limit:
+                    key, user_id = keys[index]
+                    if not key.startswith(prefix):
+                        break
+                    if user_id not in seen:
+                        seen.add(user_id)
+                        results.append(search_result(self._users[user_id], field))
+                    index += 1
+                if len(results) >= limit:
+                    break
+        return results
+
+    async def rebuild(self) -> int:
+        with self._lock:
+            self._journal = []
+        try:
+            async with read_session_scope() as db:
+                version = await crud.profile_version(db)
+                rows = await crud.search_entries(db)
+            # ✅ Sorting every user takes a while at scale: off the event loop
+            users, keys = await run_in_threadpool(self._build, rows)
+            self._swap(users, keys, version)
+        finally:
+            with self._lock:
+                self._journal = None
+        return len(rows)
+
+    async def refresh(self) -> bool:
+        """Apply users added, deleted or edited since the last check; True if anything changed."""
+        if not self.ready or self.version is None:
+            await self.rebuild()
+            return True
+        with self._lock:
+            self._journal = []
+        try:
+            async with read_session_scope() as db:
+                version = await crud.profile_version(db)
+                if version == self.version:
+                    return False
+                # ✅ Only the changed rows: a full re-sort would hold the GIL for the whole index
+                last_change = self.version[2]
+                rows = await crud.search_entries(
+                    db, changed_since=last_change - REFRESH_OVERLAP if last_change is not None else None)
+                count = version[0]
+                ids = None
+                if len(self._users.keys() | {row[0] for row in rows}) != count:
+                    ids = set(await crud.user_ids(db))  # some were deleted
+            self._apply(rows, ids, version)
+        finally:
+            with self._lock:
+                self._journal = None
+        return True
+
+    async def run(self, interval: float = SEARCH_INDEX_REFRESH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await (self.refresh() if self.ready else self.rebuild())
+            except Exception:
+                logger.exception("Search index refresh failed, will retry")
+
+
+search_index = UserSearchIndex()
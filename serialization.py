@@ -0,0 +1,64 @@
+"""Fast JSON path for user endpoints.
+
+Rows come straight from the database, so they are encoded as they are instead
+of being re-validated through UserResponse (EmailStr validation per row was
+most of the cost of a large listing). The output is byte-for-byte what the
+response_model path produced; the route keeps `response_model` for OpenAPI.
+"""
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Sequence
+from fastapi import Response
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+from models import RoleEnum
+import crud
+
+try:
+    import orjson
+except ImportError:  # pydantic-core's serializer is the fallback, a little slower
+    orjson = None
+
+
+class UserRow(TypedDict):
+    """UserResponse without validation, for serialization only."""
+    id: int
+    username: str
+    email: str
+    department: str
+    role: RoleEnum
+    last_login: Optional[datetime]
+    is_online: Optional[bool]
+
+
+# built once at import, not per request
+user_row_adapter = TypeAdapter(UserRow)
+user_rows_adapter = TypeAdapter(List[UserRow])
+_any_adapter = TypeAdapter(Any)
+
+USER_FIELDS = tuple(column.key for column in crud.USER_RESPONSE_COLUMNS)
+
+
+def dumps(value) -> bytes:
+    """Compact JSON for plain data (dicts, lists, datetimes, enums)."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return _any_adapter.dump_json(value)
+
+
+def user_dict(row: Sequence) -> dict:
+    # extra trailing columns (updated_at on single-user lookups) are left out
+    return dict(zip(USER_FIELDS, row))
+
+
+def dump_user(row: Sequence) -> bytes:
+    value = user_dict(row)
+    return orjson.dumps(value) if orjson is not None else user_row_adapter.dump_json(value)
+
+
+def dump_users(rows: Iterable[Sequence]) -> bytes:
+    value = [dict(zip(USER_FIELDS, row)) for row in rows]
+    return orjson.dumps(value) if orjson is not None else user_rows_adapter.dump_json(value)
+
+
+def user_response(row: Sequence, headers: Optional[dict] = None) -> Response:
+    return Response(dump_user(row), media_type="application/json", headers=headers)
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from dotenv import load_dotenv
+from database import DATABASE_URL, get_engine
+from migrate import migrate
+from models import User, RoleEnum
+from auth import hash_password
+
+load_dotenv()
+
+# set to false when migrate.py is run at deploy time, so workers never run DDL
+AUTO_CREATE_SCHEMA = os.getenv("AUTO_CREATE_SCHEMA", "true").lower() in ("1", "true", "yes")
+SEED_DEFAULT_ADMIN = os.getenv("SEED_DEFAULT_ADMIN", "true").lower() in ("1", "true", "yes")
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows: every worker runs the (idempotent) steps
+    fcntl = None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextmanager
+def startup_leader():
+    """Elect one worker per host to run the schema and seeding steps.
+
+    Workers forked by the same uvicorn/gunicorn master share a parent pid. The
+    first one to take the lock runs the steps and records "<ppid>:<pid>". Its
+    siblings wait on the lock, find that record with a live leader and skip.
+    Yields True when this worker should run the steps.
+    """
+    if fcntl is None:
+        yield True
+        return
+    key = hashlib.sha256(DATABASE_URL.encode()).hexdigest()[:16]
+    path = os.path.join(tempfile.gettempdir(), f"healthcare-startup-{key}.lock")
+    with open(path, "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            lock_file.seek(0)
+            ppid, _, leader = lock_file.read().strip().partition(":")
+            if ppid == str(os.getppid()) and leader.isdigit() and int(leader) != os.getpid() and _alive(int(leader)):
+                yield False
+                return
+            yield True
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(f"{os.getppid()}:{os.getpid()}")
+            lock_file.flush()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def create_default_admin() -> bool:
+    """Insert the default admin if no admin exists; safe to run from several workers at once."""
+    engine = get_engine()
+    with engine.connect() as conn:
+        if conn.scalar(select(User.id).where(User.role == RoleEnum.Admin).limit(1)) is not None:
+            return False
+
+    # only pay for the bcrypt hash when actually seeding
+    password = hash_password("Admin@123")
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(User).values(
+                username="admin",
+                email="admin@example.com",
+                password=password,  # encrypt password
+                department="Administration",
+                role=RoleEnum.Admin
+            ))
+    except IntegrityError:
+        return False  # another worker seeded it first
+    print("✅ Default Admin Created: username=admin, password=Admin@123")
+    return True
+
+
+def run_startup():
+    """Schema creation and admin seeding, run once from the app lifespan."""
+    if not (AUTO_CREATE_SCHEMA or SEED_DEFAULT_ADMIN):
+        return
+    with startup_leader() as leader:
+        if not leader:
+            return
+        if AUTO_CREATE_SCHEMA:
+            migrate(get_engine())  # missing tables and columns
+        if SEED_DEFAULT_ADMIN:
+            create_default_admin()
@@ -0,0 +1,135 @@
+"""Query-plan regression tests: every query the service issues must stay on an index.
+
+Each case runs a crud call against a scratch SQLite database, captures the SQL
+it sent and asks SQLite for `EXPLAIN QUERY PLAN`. A `SCAN` step (a full pass
+over a table or a whole index) fails the test unless the case is in
+FULL_SCAN_ALLOWED, with the reason it is expected. `USE TEMP B-TREE` (sorting
+the rows an index selected) is not a scan and is allowed.
+"""
+import asyncio
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session
+import crud
+from database import Base, ThreadedSession
+from models import RoleEnum, User
+from search import search_database
+
+FULL_SCAN_ALLOWED = {
+    "list_users": "first page of the unfiltered listing: walks the primary key and stops after LIMIT rows",
+    "collection_version": "count() reads the narrowest index once; the max() parts are single index seeks",
+    "profile_version": "same shape as collection_version",
+    "search_entries": "loads every user into the search index, once per rebuild",
+    "user_ids": "id diff for the search index, only when the count shows a deletion (reads the primary key only)",
+    "search_database": "LIKE fallback until the search index is loaded; SQLite's case-insensitive LIKE "
+                       "cannot use a b-tree (MySQL with a _ci collation does a range scan)",
+    "export": "the unfiltered export reads every user by definition",
+}
+
+CASES = {
+    # /users listing: keyset pages and every filter combination
+    "list_users": lambda db: crud.list_users(db, 100),
+    "list_users_cursor": lambda db: crud.list_users(db, 100, cursor=1),
+    "list_users_cursor_desc": lambda db: crud.list_users(db, 100, cursor=1000, order="desc"),
+    "list_users_role": lambda db: crud.list_users(db, 100, role=RoleEnum.Doctor),
+    "list_users_department": lambda db: crud.list_users(db, 100, department="ICU"),
+    "list_users_online": lambda db: crud.list_users(db, 100, is_online=True),
+    "list_users_role_department": lambda db: crud.list_users(db, 100, role=RoleEnum.Doctor, department="ICU"),
+    "list_users_role_online": lambda db: crud.list_users(db, 100, role=RoleEnum.Doctor, is_online=True),
+    "list_users_department_online": lambda db: crud.list_users(db, 100, department="ICU", is_online=True),
+    "list_users_all_filters": lambda db: crud.list_users(db, 100, cursor=1, role=RoleEnum.Doctor,
+                                                         department="ICU", is_online=False),
+    "export": lambda db: db.execute(crud.export_query()),
+    "export_filtered": lambda db: db.execute(crud.export_query(role=RoleEnum.Doctor, department="ICU")),
+    "collection_version": crud.collection_version,
+    "profile_version": crud.profile_version,
+    # single-user lookups and auth
+    "get_principal_row": lambda db: crud.get_principal_row(db, "admin"),
+    "get_credentials": lambda db: crud.get_credentials(db, "admin"),
+    "get_user_by_id": lambda db: crud.get_user_by_id(db, 1),
+    "get_user_by_email": lambda db: crud.get_user_by_email(db, "admin@example.com"),
+    "get_user_by_username": lambda db: crud.get_user_by_username(db, "admin"),
+    "get_user_version": lambda db: crud.get_user_version(db, email="admin@example.com"),
+    "default_admin_check": lambda db: db.execute(select(User.id).where(User.role == RoleEnum.Admin).limit(1)),
+    # status and presence
+    "get_status": lambda db: crud.get_status(db, "admin"),
+    "get_statuses_usernames": lambda db: crud.get_statuses(db, ["admin", "doctor1"]),
+    "get_statuses_department": lambda db: crud.get_statuses(db, department="ICU"),
+    "expire_sessions": lambda db: crud.expire_sessions(db, datetime.utcnow()),
+    # search
+    "search_entries": crud.search_entries,
+    "search_entries_changed": lambda db: crud.search_entries(db, changed_since=datetime.utcnow()),
+    "user_ids": crud.user_ids,
+    "search_database": lambda db: search_database(db, "doc", 10),
+    # writes
+    "create_user": lambda db: crud.create_user(db, {"username": "new", "email": "new@example.com", "password": "x",
+                                                    "department": "ICU", "role": RoleEnum.Doctor}),
+    "update_user": lambda db: crud.update_user(db, 2, {"department": "Oncology"}),
+    "replace_password_hash": lambda db: crud.replace_password_hash(db, 2, "x", "y"),
+    "delete_user": lambda db: crud.delete_user(db, 3),
+    "find_taken": lambda db: crud.find_taken(db, ["admin", "new2"], ["new2@example.com"]),
+    "insert_users": lambda db: crud.insert_users(db, [{"username": "new3", "email": "new3@example.com",
+                                                        "password": "x", "department": "ICU",
+                                                        "role": RoleEnum.Doctor}]),
+    "insert_audit_events": lambda db: crud.insert_audit_events(db, [{"at": datetime.utcnow(), "action": "login",
+                                                                     "success": True}]),
+}
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add(User(username="admin", email="admin@example.com", password="x", department="IT",
+                         role=RoleEnum.Admin))
+        session.add_all(User(username=f"doctor{i}", email=f"doctor{i}@example.com", password="x",
+                             department="ICU", role=RoleEnum.Doctor) for i in range(1, 4))
+        session.commit()
+    yield engine
+    engine.dispose()
+
+
+def capture(engine, call):
+    """SQL statements (with parameters) the call sent to the database."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters[0] if executemany else parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        async def run():
+            with Session(engine) as session:
+                await call(ThreadedSession(session))
+        asyncio.run(run())
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def full_scans(engine, statement, parameters):
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+    return [detail for _, _, _, detail in plan if detail.startswith("SCAN ")]
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_query_uses_index(engine, name):
+    statements = capture(engine, CASES[name])
+    assert statements, f"{name} issued no SQL"
+    scans = [(statement, scan) for statement, parameters in statements
+             for scan in full_scans(engine, statement, parameters)]
+    if name in FULL_SCAN_ALLOWED:
+        # keeps the allowlist honest: a query that stopped scanning should leave it
+        assert scans, f"{name} no longer scans, remove it from FULL_SCAN_ALLOWED"
+    else:
+        assert not scans, f"{name} does a full scan: {scans}"
+
+
+def test_models_declare_the_index_plan():
+    indexes = {index.name: [column.name for column in index.columns] for index in User.__table__.indexes}
+    assert indexes["ix_users_role_department_is_online"] == ["role", "department", "is_online"]
+    assert indexes["ix_users_department_is_online"] == ["department", "is_online"]
+    assert indexes["ix_users_is_online_last_login"] == ["is_online", "last_login"]
@@ -0,0 +1,195 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from hashing import password_hasher
+
+load_dotenv()
+
+LOGIN_RATE_LIMIT_ENABLED = os.getenv("LOGIN_RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+LOGIN_USER_BURST = float(os.getenv("LOGIN_USER_BURST", "5"))          # attempts per username before throttling
+LOGIN_USER_RATE = float(os.getenv("LOGIN_USER_RATE", "0.0833"))       # refill per second (5 per minute)
+LOGIN_IP_BURST = float(os.getenv("LOGIN_IP_BURST", "20"))             # failed attempts per client IP before throttling
+LOGIN_IP_RATE = float(os.getenv("LOGIN_IP_RATE", "1"))                # refill per second
+LOGIN_THROTTLE_MAX_KEYS = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+LOGIN_THROTTLE_REDIS_URL = os.getenv("LOGIN_THROTTLE_REDIS_URL")      # shared buckets for multi-worker setups
+
+
+class MemoryBucketStore:
+    """Token buckets in one LRU-bounded dict: key -> [tokens, last refill time]."""
+
+    def __init__(self, max_keys: int = LOGIN_THROTTLE_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        """Take ``cost`` tokens; returns 0 when allowed, else seconds until it would be."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= cost:
+                bucket[0] = tokens - cost
+                return 0.0
+            bucket[0] = tokens
+            return (cost - tokens) / rate
+
+    async def peek(self, key: str, burst: float, rate: float, cost: float) -> float:
+        """Like take, without taking: 0 when ``cost`` tokens are there, else seconds until they would be."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            tokens = min(burst, bucket[0] + (time.monotonic() - bucket[1]) * rate)
+        return 0.0 if tokens >= cost else (cost - tokens) / rate
+
+    async def give(self, key: str, burst: float, cost: float):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(burst, bucket[0] + cost)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RedisBucketStore:
+    """Same buckets kept in Redis, updated atomically by a Lua script."""
+
+    SCRIPT = """
+    local burst, rate, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    local retry = 0
+    if tokens >= cost then tokens = tokens - cost else retry = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(retry)
+    """
+
+    # reads the refilled balance without writing, like MemoryBucketStore.peek
+    PEEK_SCRIPT = """
+    local burst, rate, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local clock = redis.call('TIME')
+    local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    if tokens >= cost then return '0' end
+    return tostring((cost - tokens) / rate)
+    """
+
+    # adds tokens back without refilling or touching the TTL, like MemoryBucketStore.give
+    REFUND_SCRIPT = """
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    if tokens then
+        redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2])))
+    end
+    return 0
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("LOGIN_THROTTLE_REDIS_URL is set but the 'redis' package is not installed")
+            client = redis.from_url(url)
+        self._client = client
+        self._script = self._client.register_script(self.SCRIPT)
+        self._peek = self._client.register_script(self.PEEK_SCRIPT)
+        self._refund = self._client.register_script(self.REFUND_SCRIPT)
+
+    async def take(self, key: str, burst: float, rate: float, cost: float) -> float:
+        return float(await self._script(keys=[f"login-throttle:{key}"], args=[burst, rate, cost]))
+
+    async def peek(self, key: str, burst: float, rate: float, cost: float) -> float:
+        return float(await self._peek(keys=[f"login-throttle:{key}"], args=[burst, rate, cost]))
+
+    async def give(self, key: str, burst: float, cost: float):
+        await self._refund(keys=[f"login-throttle:{key}"], args=[burst, cost])
+
+    def __len__(self) -> int:
+        return 0
+
+
+class LoginThrottle:
+    """Per-username and per-IP token buckets checked before any bcrypt work.
+
+    Every attempt takes a token from the username's bucket and a successful
+    login gives it back. The IP bucket is only checked up front and charged
+    once a verification has failed, so any number of correct logins from one
+    shared address (a site behind NAT or a proxy) is never throttled. Only
+    failed attempts drain either bucket. While the hashing pool is at least
+    half busy an attempt costs two tokens, so abusive clients are cut off
+    sooner exactly when bcrypt CPU is scarce.
+    """
+
+    def __init__(self, store=None, enabled: bool = LOGIN_RATE_LIMIT_ENABLED):
+        self.enabled = enabled
+        self.rejected = 0
+        self._store = store
+        self._store_lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = RedisBucketStore(LOGIN_THROTTLE_REDIS_URL) if LOGIN_THROTTLE_REDIS_URL else MemoryBucketStore()
+        return self._store
+
+    def _cost(self) -> float:
+        return 2.0 if password_hasher.pending * 2 >= password_hasher.capacity else 1.0
+
+    def _reject(self, retry_after: float):
+        self.rejected += 1
+        raise HTTPException(
+            status_code=429,
+            detail="Too many login attempts, please retry later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, username: str, ip: Optional[str]) -> float:
+        """Take the attempt's tokens or raise 429; returns the cost to refund on success."""
+        if not self.enabled:
+            return 0.0
+        cost = self._cost()
+        retry_after = await self.store.peek(f"ip:{ip or 'unknown'}", LOGIN_IP_BURST, LOGIN_IP_RATE, cost)
+        if retry_after:
+            self._reject(retry_after)
+        retry_after = await self.store.take(f"user:{username}", LOGIN_USER_BURST, LOGIN_USER_RATE, cost)
+        if retry_after:
+            self._reject(retry_after)
+        return cost
+
+    async def succeeded(self, username: str, ip: Optional[str], cost: float):
+        if not self.enabled or not cost:
+            return
+        await self.store.give(f"user:{username}", LOGIN_USER_BURST, cost)
+
+    async def failed(self, ip: Optional[str], cost: float):
+        """Charge a failed verification to the client IP."""
+        if not self.enabled or not cost:
+            return
+        await self.store.take(f"ip:{ip or 'unknown'}", LOGIN_IP_BURST, LOGIN_IP_RATE, cost)
+
+
+login_throttle = LoginThrottle()